@@ -1,24 +1,31 @@
+import os
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from datetime import timedelta
+from .query_budget import install_query_budget
+from .database import configure_engine_options, database_config_from_env, install_sqlite_pragmas
 db = SQLAlchemy()
 login_manager = LoginManager()
 
 @login_manager.user_loader
 def load_user(user_id):
-    from app.models import User
-    return User.query.get(int(user_id))
+    from app.principals import load_principal
+    return load_principal(user_id)
 
-def create_app():
+def create_app(config=None):
     app = Flask(__name__)
     app.config['SECRET_KEY'] = 'veditharv'  
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['SESSION_COOKIE_SECURE'] = True 
     app.config['SESSION_COOKIE_HTTPONLY'] = True 
     app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=60) 
     app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
+    app.config.update(database_config_from_env(app))
+    if config:
+        app.config.update(config)
+    app.config.setdefault('SKIP_DB_INIT', os.environ.get('SKIP_DB_INIT', '') in ('1', 'true'))
+    configure_engine_options(app)
     db.init_app(app)
     login_manager.init_app(app)
     login_manager.login_view = 'auth.login'
@@ -33,19 +40,41 @@ def create_app():
     app.register_blueprint(user)
     app.register_blueprint(admin)
 
+    from .commands import register_commands
+    register_commands(app)
+
+    from .spotmap import init_spot_maps
+    init_spot_maps(app)
+    from .live import init_availability_hub
+    init_availability_hub(app)
+    from .principals import init_user_cache
+    init_user_cache(app)
+    from .passwords import init_password_hashing
+    init_password_hashing(app)
+    from .response_cache import init_response_cache
+    init_response_cache(app)
+    from .jobs import init_jobs
+    init_jobs(app)
+    from .archive import init_archive
+    init_archive(app)
+    from .templating import init_template_cache
+    init_template_cache(app)
+
     with app.app_context():
-        db.create_all()
-        from app.models import User
-        try:
-            if not User.query.filter_by(username='admin').first():
-                admin = User(username='admin')
-                admin.set_password('admin123')
-                admin.is_admin=True
-                admin.email = 'admin@example.com'
-                admin.full_name = 'Admin'
-                db.session.add(admin)
-                db.session.commit()
-        except Exception as e:
-            print(f"[ERROR] Could not create default admin: {e}")
+        install_sqlite_pragmas(app, db.engine)
+        install_query_budget(app, db.engine)
+        from .profiling import install_profiling
+        install_profiling(app, db.engine)
+        # With SKIP_DB_INIT the schema and admin account come from `flask
+        # migrate` and `flask seed-admin`, run once per deploy instead of on
+        # every cold start.
+        if not app.config['SKIP_DB_INIT']:
+            from .bootstrap import migrate, seed_admin
+            migrate()
+            try:
+                seed_admin()
+            except Exception as e:
+                db.session.rollback()
+                print(f"[ERROR] Could not create default admin: {e}")
 
     return app
@@ -0,0 +1,128 @@
+from sqlalchemy import literal, select, union_all, update
+from . import db
+from .models import ParkingSpot
+from .occupancy import adjust_counts, adjust_counts_many
+from .spot_events import record_spot_change
+
+MAX_CLAIM_ATTEMPTS = 10
+
+
+def _first_free_spot(lot_id):
+    # Served by ix_parking_spots_lot_status: (lot_id, status) plus the rowid
+    # gives the lowest free spot id without touching the rest of the lot.
+    return db.session.execute(
+        select(ParkingSpot.id)
+        .where(ParkingSpot.lot_id == lot_id, ParkingSpot.status == 'A')
+        .order_by(ParkingSpot.id)
+        .limit(1)
+    ).scalar()
+
+
+def claim_spot(lot_id):
+    """Mark the first free spot of a lot occupied and return its id.
+
+    The claim is a conditional UPDATE, so if another request takes the same
+    spot first we see rowcount 0 and look again. Returns None when the lot
+    is full. The caller owns the transaction and must commit.
+    """
+    for _ in range(MAX_CLAIM_ATTEMPTS):
+        spot_id = _first_free_spot(lot_id)
+        if spot_id is None:
+            return None
+        claimed = db.session.execute(
+            update(ParkingSpot)
+            .where(ParkingSpot.id == spot_id, ParkingSpot.status == 'A')
+            .values(status='O')
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if claimed:
+            adjust_counts(lot_id, 1)
+            record_spot_change(db.session, lot_id, spot_id, True)
+            return spot_id
+    return None
+
+
+def free_spot(spot_id, lot_id):
+    freed = db.session.execute(
+        update(ParkingSpot)
+        .where(ParkingSpot.id == spot_id, ParkingSpot.status == 'O')
+        .values(status='A')
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if freed:
+        adjust_counts(lot_id, -1)
+        record_spot_change(db.session, lot_id, spot_id, False)
+    return bool(freed)
+
+
+def _free_spot_candidates(lot_ids, count):
+    # One statement for every preferred lot: each branch walks
+    # ix_parking_spots_lot_status for its lot and stops after count rows, so
+    # nothing sorts a lot's whole free list.
+    branches = [
+        select(ParkingSpot.id, literal(rank).label('rank'))
+        .where(ParkingSpot.lot_id == lot_id, ParkingSpot.status == 'A')
+        .order_by(ParkingSpot.id)
+        .limit(count)
+        .subquery()
+        for rank, lot_id in enumerate(lot_ids)
+    ]
+    candidates = union_all(*(select(branch.c.id, branch.c.rank) for branch in branches)).subquery()
+    return select(candidates.c.id).order_by(candidates.c.rank, candidates.c.id).limit(count)
+
+
+def _claimed_by_lot(rows, lot_ids):
+    by_lot = {}
+    for spot_id, lot_id in rows:
+        by_lot.setdefault(lot_id, []).append(spot_id)
+    return {lot_id: sorted(by_lot[lot_id]) for lot_id in lot_ids if lot_id in by_lot}
+
+
+def claim_spots(lot_ids, count):
+    """Mark up to count free spots occupied, filling lots in the given order.
+
+    Returns {lot_id: [spot_id, ...]} in preference order. Candidates come
+    from one query and are claimed with one conditional UPDATE ... RETURNING;
+    spots another request took in between are topped up from a fresh query.
+    The caller owns the transaction and must commit, or roll back a short
+    claim it cannot use.
+    """
+    rows = []
+    for _ in range(MAX_CLAIM_ATTEMPTS):
+        wanted = count - len(rows)
+        candidates = db.session.scalars(_free_spot_candidates(lot_ids, wanted)).all()
+        if not candidates:
+            break
+        rows += db.session.execute(
+            update(ParkingSpot)
+            .where(ParkingSpot.id.in_(candidates), ParkingSpot.status == 'A')
+            .values(status='O')
+            .returning(ParkingSpot.id, ParkingSpot.lot_id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        if len(rows) == count or len(candidates) < wanted:
+            break
+
+    claimed = _claimed_by_lot(rows, lot_ids)
+    adjust_counts_many({lot_id: len(spot_ids) for lot_id, spot_ids in claimed.items()})
+    for lot_id, spot_ids in claimed.items():
+        for spot_id in spot_ids:
+            record_spot_change(db.session, lot_id, spot_id, True)
+    return claimed
+
+
+def free_spots(spot_ids):
+    """Free many occupied spots at once; returns {lot_id: [spot_id, ...]}."""
+    rows = db.session.execute(
+        update(ParkingSpot)
+        .where(ParkingSpot.id.in_(spot_ids), ParkingSpot.status == 'O')
+        .values(status='A')
+        .returning(ParkingSpot.id, ParkingSpot.lot_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    freed = _claimed_by_lot(rows, sorted({lot_id for _, lot_id in rows}))
+    adjust_counts_many({lot_id: -len(ids) for lot_id, ids in freed.items()})
+    for lot_id, ids in freed.items():
+        for spot_id in ids:
+            record_spot_change(db.session, lot_id, spot_id, False)
+    return freed
@@ -0,0 +1,228 @@
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import (Column, DateTime, Float, Index, Integer, MetaData, String, Table, delete, func, insert,
+                        select, tuple_, union_all)
+from . import db
+from .models import ArchivedReservationCount, ParkingLot, ParkingSpot, Reservation, ReservationArchive
+from .response_cache import bump
+
+ARCHIVE_AFTER_DAYS = 180
+CHUNK_SIZE = 1000
+
+# Archive tables live outside db.metadata so create_all() never creates or
+# drops them; they are created the first time a month is archived.
+archive_metadata = MetaData()
+
+
+def archive_table(month):
+    """The Table for one month ('YYYY-MM' of parking_time)."""
+    name = 'reservations_archive_' + month.replace('-', '_')
+    table = archive_metadata.tables.get(name)
+    if table is None:
+        table = Table(
+            name, archive_metadata,
+            Column('id', Integer, primary_key=True),  # the original reservation id
+            Column('user_id', Integer, nullable=False),
+            Column('spot_id', Integer, nullable=False),
+            # Denormalized: the lot may be deleted or renamed after archiving.
+            Column('lot_id', Integer, nullable=False),
+            Column('lot_name', String(100)),
+            Column('parking_time', DateTime, nullable=False),
+            Column('leaving_time', DateTime, nullable=False),
+            Column('cost_per_hour', Float),
+            Index(f'ix_{name}_user', 'user_id', 'parking_time'),
+            Index(f'ix_{name}_lot', 'lot_id', 'parking_time'),
+            Index(f'ix_{name}_parking_time', 'parking_time'),
+        )
+    return table
+
+
+def _month(ts):
+    return ts.strftime('%Y-%m')
+
+
+def archived_months(since=None, until=None):
+    """Archived months overlapping [since, until), oldest first."""
+    query = select(ReservationArchive.month).order_by(ReservationArchive.month)
+    if since:
+        query = query.where(ReservationArchive.month >= _month(since))
+    if until:
+        query = query.where(ReservationArchive.month <= _month(until))
+    return db.session.scalars(query).all()
+
+
+def history(user_id=None, since=None, until=None, completed=False, lot_id=None, active=False,
+            before=None, limit=None, months=None):
+    """Live and archived reservations as one subquery.
+
+    Columns: id, user_id, spot_id, lot_id, location, parking_time,
+    leaving_time, cost_per_hour. Filters are applied inside every branch so
+    each can use its own index, and only archive months overlapping the
+    parking_time range are read (one catalog query; none for active stays,
+    which are never archived). Callers building several subqueries over the
+    same range can pass that range's archived_months() as `months` to skip
+    the catalog query.
+
+    With limit, each branch is cut to its newest `limit` rows before the
+    union, optionally after the (parking_time, id) keyset `before`, so a
+    page costs the same however much history there is.
+    """
+    def filtered(query, columns):
+        if user_id is not None:
+            query = query.where(columns.user_id == user_id)
+        if lot_id is not None:
+            query = query.where(columns.lot_id == lot_id)
+        if since:
+            query = query.where(columns.parking_time >= since)
+        if until:
+            query = query.where(columns.parking_time < until)
+        if before:
+            query = query.where(tuple_(columns.parking_time, columns.id) < tuple_(*before))
+        if limit:
+            query = select(query.order_by(columns.parking_time.desc(), columns.id.desc()).limit(limit).subquery())
+        return query
+
+    live = (
+        select(Reservation.id, Reservation.user_id, Reservation.spot_id, Reservation.lot_id,
+               ParkingLot.prime_location_name.label('location'), Reservation.parking_time,
+               Reservation.leaving_time, Reservation.cost_per_hour)
+        .join(ParkingLot, Reservation.lot_id == ParkingLot.id)
+    )
+    if completed:
+        live = live.where(Reservation.leaving_time.isnot(None))
+    if active:
+        live = live.where(Reservation.leaving_time.is_(None))
+    branches = [filtered(live, Reservation)]
+    if not active:
+        newest = before[0] if before and not (until and until < before[0]) else until
+        if months is None:
+            months = archived_months(since, newest)
+        elif newest:
+            months = [month for month in months if month <= _month(newest)]
+        for month in months:
+            table = archive_table(month)
+            branches.append(filtered(
+                select(table.c.id, table.c.user_id, table.c.spot_id, table.c.lot_id,
+                       table.c.lot_name.label('location'), table.c.parking_time,
+                       table.c.leaving_time, table.c.cost_per_hour),
+                table.c,
+            ))
+    return (union_all(*branches) if len(branches) > 1 else branches[0]).subquery('history')
+
+
+def upgrade_archive_indexes():
+    """Create the indexes archive_table() declares on every archived month.
+
+    Tables are only created with their indexes the first time a month is
+    archived, so months archived before an index was added lack it.
+    """
+    connection = db.session.connection()
+    for month in archived_months():
+        for index in archive_table(month).indexes:
+            index.create(connection, checkfirst=True)
+    db.session.commit()
+
+
+def archived_stays(lot_id=None):
+    """(lot_id, parking_time, leaving_time, cost_per_hour) selects for every
+    archive month, for rebuilding rollups from the full history.
+    """
+    branches = []
+    for month in archived_months():
+        table = archive_table(month)
+        query = select(table.c.lot_id, table.c.parking_time, table.c.leaving_time, table.c.cost_per_hour)
+        if lot_id is not None:
+            query = query.where(table.c.lot_id == lot_id)
+        branches.append(query)
+    return branches
+
+
+def archived_spot_ids(lot_id):
+    """A select of the spot ids the lot's archived stays reference, or None
+    when nothing is archived.
+    """
+    branches = []
+    for month in archived_months():
+        table = archive_table(month)
+        branches.append(select(table.c.spot_id).where(table.c.lot_id == lot_id))
+    if not branches:
+        return None
+    return union_all(*branches) if len(branches) > 1 else branches[0]
+
+
+def archived_count(user_id):
+    return (
+        select(func.coalesce(func.max(ArchivedReservationCount.count), 0))
+        .where(ArchivedReservationCount.user_id == user_id)
+        .scalar_subquery()
+    )
+
+
+def reservation_count(user_id):
+    """Live plus archived reservations of one user, in one query."""
+    live = select(func.count(Reservation.id)).where(Reservation.user_id == user_id).scalar_subquery()
+    return db.session.scalar(select(live + archived_count(user_id)))
+
+
+def archive_reservations(older_than_days, progress=None):
+    """Move completed reservations that ended more than older_than_days ago
+    into the per-month archive tables, CHUNK_SIZE rows per transaction.
+
+    progress(done, total) is called after each commit. Returns the number of
+    reservations archived.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    total = db.session.scalar(select(func.count(Reservation.id)).where(Reservation.leaving_time < cutoff))
+    if progress:
+        progress(0, total)
+    done = 0
+    while True:
+        rows = db.session.execute(
+            select(Reservation.id, Reservation.user_id, Reservation.spot_id, ParkingSpot.lot_id,
+                   ParkingLot.prime_location_name.label('lot_name'), Reservation.parking_time,
+                   Reservation.leaving_time, Reservation.cost_per_hour)
+            .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id)
+            .join(ParkingLot, ParkingSpot.lot_id == ParkingLot.id)
+            .where(Reservation.leaving_time < cutoff)
+            .limit(CHUNK_SIZE)
+        ).all()
+        if not rows:
+            break
+
+        by_month, per_user = {}, {}
+        for row in rows:
+            by_month.setdefault(_month(row.parking_time), []).append(row._asdict())
+            per_user[row.user_id] = per_user.get(row.user_id, 0) + 1
+        connection = db.session.connection()
+        for month, values in by_month.items():
+            table = archive_table(month)
+            entry = db.session.get(ReservationArchive, month)
+            if entry is None:
+                table.create(connection, checkfirst=True)
+                entry = ReservationArchive(month=month, table_name=table.name, row_count=0)
+                db.session.add(entry)
+            db.session.execute(insert(table), values)
+            entry.row_count += len(values)
+            entry.archived_at = datetime.utcnow()
+        for user_id, count in per_user.items():
+            entry = db.session.get(ArchivedReservationCount, user_id)
+            if entry is None:
+                entry = ArchivedReservationCount(user_id=user_id, count=0)
+                db.session.add(entry)
+            entry.count += count
+        db.session.execute(
+            delete(Reservation)
+            .where(Reservation.id.in_([row.id for row in rows]))
+            .execution_options(synchronize_session=False)
+        )
+        # Archiving removes old rows, which the newest-id version cannot see.
+        bump('reservations')
+        db.session.commit()
+        done += len(rows)
+        if progress:
+            progress(done, total)
+    return done
+
+
+def init_archive(app):
+    app.config.setdefault('ARCHIVE_AFTER_DAYS', int(os.environ.get('ARCHIVE_AFTER_DAYS', ARCHIVE_AFTER_DAYS)))
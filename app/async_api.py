@@ -0,0 +1,254 @@
+import asyncio
+import json
+import os
+import re
+import time
+from hashlib import sha512
+from http.cookies import CookieError, SimpleCookie
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from itsdangerous import BadSignature
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from .database import _is_sqlite_memory, install_sqlite_pragmas
+from .models import ParkingLot, Reservation, User
+
+PREFIX = '/api/async'
+# Lot listings and per-lot counts are shared for this long; concurrent
+# requests for the same thing always share one query.
+MAX_AGE = 1.0
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg'}
+
+
+class Unauthorized(Exception):
+    pass
+
+
+def async_database_url(url):
+    """The async-driver URL for a SQLAlchemy URL (aiosqlite or asyncpg)."""
+    url = make_url(url)
+    if _is_sqlite_memory(url):
+        raise ValueError('The async API needs a database shared with the app, not in-memory SQLite.')
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f'No async driver configured for {url.get_backend_name()}.')
+    return url.set(drivername=driver)
+
+
+class SharedReads:
+    """Coalesces identical reads.
+
+    While a read is in flight, every request for the same key awaits it
+    instead of issuing its own query, and the result is reused for
+    max_age seconds after it lands (0 = only while in flight). A client
+    that disconnects does not cancel the read for the others.
+    """
+
+    def __init__(self):
+        self._entries = {}
+
+    async def get(self, key, fetch, max_age):
+        entry = self._entries.get(key)
+        if entry is None or (entry[0].done() and entry[1] <= time.monotonic()):
+            future = asyncio.ensure_future(fetch())
+            entry = self._entries[key] = (future, float('inf'))
+            future.add_done_callback(lambda done: self._landed(key, done, max_age))
+        return await asyncio.shield(entry[0])
+
+    def _landed(self, key, future, max_age):
+        if self._entries.get(key, (None,))[0] is not future:
+            return
+        if max_age and not future.cancelled() and future.exception() is None:
+            self._entries[key] = (future, time.monotonic() + max_age)
+        else:
+            del self._entries[key]
+
+
+def _session_identifier(scope, headers):
+    # Flask-Login's "strong" session protection hashes the client address
+    # and user agent (flask_login.utils._create_identifier); match it.
+    address = headers.get(b'x-forwarded-for') or (scope['client'][0].encode() if scope.get('client') else None)
+    if address is not None:
+        address = address.split(b',')[0].strip()
+    base = f"{address}|{headers.get(b'user-agent')}"
+    return sha512(base.encode('utf8')).hexdigest()
+
+
+class AsyncAPI:
+    """Read-only JSON endpoints under PREFIX, served on asyncio.
+
+    Meant for clients that poll: each request awaits the database instead
+    of holding a worker thread, so one process keeps thousands of them
+    open. Requests authenticate with the Flask session cookie and query the
+    same tables through the shared models, over an async driver with its
+    own connection pool (sized like the app's). Anything outside PREFIX
+    goes to `fallback`, normally the Flask app.
+    """
+
+    def __init__(self, flask_app, fallback=None):
+        config = flask_app.config
+        config.setdefault('ASYNC_API_MAX_AGE', float(os.environ.get('ASYNC_API_MAX_AGE', MAX_AGE)))
+        config.setdefault('ASYNC_DATABASE_URL', os.environ.get('ASYNC_DATABASE_URL')
+                          or async_database_url(config['SQLALCHEMY_DATABASE_URI']))
+        self.max_age = config['ASYNC_API_MAX_AGE']
+        self.fallback = fallback
+        options = dict(config['SQLALCHEMY_ENGINE_OPTIONS'])
+        if make_url(config['ASYNC_DATABASE_URL']).get_backend_name() == 'sqlite':
+            # aiosqlite defaults to NullPool, i.e. a new connection (and thread) per query.
+            options.setdefault('poolclass', AsyncAdaptedQueuePool)
+        self.engine = create_async_engine(config['ASYNC_DATABASE_URL'], **options)
+        install_sqlite_pragmas(flask_app, self.engine.sync_engine)
+        self.reads = SharedReads()
+        self._serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+        self._cookie_name = flask_app.config['SESSION_COOKIE_NAME']
+        self._session_max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+        self._strong = flask_app.login_manager.session_protection == 'strong'
+        self.routes = [
+            (re.compile(r'/lots'), self.lots),
+            (re.compile(r'/lots/(\d+)/availability'), self.lot_availability),
+            (re.compile(r'/my-reservations'), self.my_reservations),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        path = scope.get('path', '')
+        if scope['type'] != 'http' or not (path == PREFIX or path.startswith(PREFIX + '/')):
+            if self.fallback is None:
+                return await _respond(send, 404, {'error': 'not found'})
+            return await self.fallback(scope, receive, send)
+
+        for pattern, handler in self.routes:
+            match = pattern.fullmatch(path[len(PREFIX):])
+            if match:
+                break
+        else:
+            return await _respond(send, 404, {'error': 'not found'})
+        if scope['method'] not in ('GET', 'HEAD'):
+            return await _respond(send, 405, {'error': 'method not allowed'}, [(b'allow', b'GET, HEAD')])
+        try:
+            user_id = await self._authenticate(scope)
+            body = await handler(user_id, *(int(group) for group in match.groups()))
+        except Unauthorized:
+            return await _respond(send, 401, {'error': 'login required'})
+        if body is None:
+            return await _respond(send, 404, {'error': 'not found'})
+        await _respond(send, 200, body, head=scope['method'] == 'HEAD')
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _query(self, statement):
+        async with self.engine.connect() as connection:
+            return (await connection.execute(statement)).all()
+
+    async def _authenticate(self, scope):
+        """The logged-in user's id, as Flask-Login would resolve the session."""
+        headers = {}
+        for name, value in scope.get('headers', ()):
+            headers[name] = headers[name] + b'; ' + value if name == b'cookie' and name in headers else value
+        cookie = SimpleCookie()
+        try:
+            cookie.load(headers.get(b'cookie', b'').decode('latin-1'))
+        except CookieError:
+            raise Unauthorized
+        morsel = cookie.get(self._cookie_name)
+        if morsel is None:
+            raise Unauthorized
+        try:
+            session = self._serializer.loads(morsel.value, max_age=self._session_max_age)
+        except BadSignature:
+            raise Unauthorized
+        user_id, _, version = str(session.get('_user_id', '')).partition(':')
+        if not user_id.isdigit():
+            raise Unauthorized
+        if self._strong and session.get('_id') != _session_identifier(scope, headers):
+            raise Unauthorized
+        user_id = int(user_id)
+        rows = await self.reads.get(
+            ('user', user_id),
+            lambda: self._query(select(User.password_version).where(User.id == user_id)),
+            self.max_age,
+        )
+        # Sessions from before versioned ids carry no version and are accepted.
+        if not rows or (version and str(rows[0].password_version) != version):
+            raise Unauthorized
+        return user_id
+
+    async def lots(self, user_id):
+        rows = await self.reads.get('lots', lambda: self._query(
+            select(ParkingLot.id, ParkingLot.prime_location_name, ParkingLot.address,
+                   ParkingLot.price_per_hour, ParkingLot.max_spots, ParkingLot.available_count)
+            .order_by(ParkingLot.id)
+        ), self.max_age)
+        # The same shape as GET /admin/api/lots.
+        return [
+            {'id': row.id, 'name': row.prime_location_name, 'address': row.address,
+             'price_per_hour': row.price_per_hour, 'total_spots': row.max_spots,
+             'available_spots': row.available_count}
+            for row in rows
+        ]
+
+    async def lot_availability(self, user_id, lot_id):
+        rows = await self.reads.get(('lot', lot_id), lambda: self._query(
+            select(ParkingLot.available_count, ParkingLot.occupied_count, ParkingLot.max_spots)
+            .where(ParkingLot.id == lot_id)
+        ), self.max_age)
+        if not rows:
+            return None
+        # The same shape as a lot in GET /api/availability.
+        available, occupied, total = rows[0]
+        return {'id': lot_id, 'available': available, 'occupied': occupied, 'total': total}
+
+    async def my_reservations(self, user_id):
+        # Not reused once answered: a user expects their own booking to show up at once.
+        rows = await self.reads.get(('reservations', user_id), lambda: self._query(
+            select(Reservation.id, Reservation.spot_id, Reservation.lot_id,
+                   ParkingLot.prime_location_name, Reservation.parking_time, Reservation.cost_per_hour)
+            .join(ParkingLot, Reservation.lot_id == ParkingLot.id)
+            .where(Reservation.user_id == user_id, Reservation.leaving_time.is_(None))
+            .order_by(Reservation.parking_time.desc())
+        ), 0)
+        return [
+            {'id': row.id, 'spot_id': row.spot_id, 'lot_id': row.lot_id, 'location': row.prime_location_name,
+             'parking_time': row.parking_time.isoformat(), 'cost_per_hour': row.cost_per_hour}
+            for row in rows
+        ]
+
+
+async def _respond(send, status, body, headers=(), head=False):
+    payload = json.dumps(body).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode()),
+                    (b'cache-control', b'no-store'), *headers],
+    })
+    await send({'type': 'http.response.body', 'body': b'' if head else payload})
+
+
+class _ThreadedWsgiInstance(WsgiToAsgiInstance):
+    # asgiref runs every WSGI call on one shared thread by default, which
+    # would serialize the whole Flask app; use the loop's thread pool.
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False)
+
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    """WsgiToAsgi that runs concurrent WSGI requests on separate threads."""
+
+    async def __call__(self, scope, receive, send):
+        await _ThreadedWsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+def mount(flask_app):
+    """One ASGI app: the async read API under PREFIX, Flask for everything else."""
+    return AsyncAPI(flask_app, fallback=ThreadedWsgiToAsgi(flask_app))
@@ -2,6 +2,8 @@ from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, login_required
 from app.models import User
 from app import db
+from app.passwords import HashingBusy, current_hasher
+from app.response_cache import bump
 
 auth = Blueprint('auth', __name__)
 
@@ -12,7 +14,13 @@ def login():
         password = request.form.get('password')
         
         user = User.query.filter_by(username=username).first()
-        if user and user.check_password(password):
+        try:
+            valid = user is not None and current_hasher().verify(user.password_hash, password or '')
+        except HashingBusy:
+            flash('Too many sign-in attempts right now. Please try again in a moment.')
+            return render_template('auth/login.html'), 503, {'Retry-After': '2'}
+        if valid:
+            current_hasher().rehash_later(user.id, user.password_hash, password)
             login_user(user)
             if user.is_admin:
                 return redirect(url_for('admin.admin_dashboard'))
@@ -46,6 +54,7 @@ def register():
         user = User(username=username, email=email, full_name=full_name)
         user.set_password(password)
         db.session.add(user)
+        bump('users')
         db.session.commit()
 
         flash('Registration successful! Please login.')
@@ -0,0 +1,154 @@
+from datetime import datetime
+from sqlalchemy import String, select, type_coerce
+from . import db
+from .archive import history
+from .models import ParkingLot, User
+
+# Invoices are per user or per lot and per calendar month. A stay belongs
+# to the month its parking_time falls in, the same partitioning as the
+# history filters and the archive, so a month reads one archive table or
+# an index range of the live one. Only completed stays are billed; a stay
+# still active when invoices are generated shows up on a later run.
+BILL_BY = ('user', 'lot')
+FETCH_SIZE = 100000
+STAY_FIELDS = [('user_id', 'i8'), ('lot_id', 'i8'), ('parking_time', 'M8[us]'), ('leaving_time', 'M8[us]'),
+               ('cost_per_hour', 'f8')]
+
+
+class BillingError(ValueError):
+    pass
+
+
+def parse_month(value=None):
+    """(month, start, end) for 'YYYY-MM'; defaults to the last full month."""
+    if value:
+        try:
+            start = datetime.strptime(value, '%Y-%m')
+        except (TypeError, ValueError):
+            raise BillingError('month must look like YYYY-MM')
+    else:
+        today = datetime.utcnow()
+        start = datetime(today.year - (today.month == 1), (today.month - 2) % 12 + 1, 1)
+    end = datetime(start.year + (start.month == 12), start.month % 12 + 1, 1)
+    return start.strftime('%Y-%m'), start, end
+
+
+def parse_by(value):
+    if value not in BILL_BY:
+        raise BillingError(f'by must be one of: {", ".join(BILL_BY)}')
+    return value
+
+
+def stay_costs(parking_times, leaving_times, rates):
+    """Vectorized models.stay_cost_paise: int64 paise per stay.
+
+    Takes datetime64[us] arrays and a float array of rupees per hour.
+    """
+    import numpy as np
+
+    seconds = (leaving_times - parking_times) / np.timedelta64(1, 's')
+    return np.floor(seconds * rates * 100 / 3600 + 0.5).astype(np.int64)
+
+
+def _stays(month, extra_fields=(), **filters):
+    """Every completed stay parked in the month, fetched in one query.
+
+    Returns (month, records, seconds, paise): a NumPy record array with
+    STAY_FIELDS plus extra_fields ((history column, dtype) pairs), and the
+    duration and cost of each stay.
+    """
+    import numpy as np
+
+    month, start, end = parse_month(month)
+    stays = history(since=start, until=end, completed=True, **filters)
+    times = [stays.c.parking_time, stays.c.leaving_time]
+    if db.engine.dialect.name == 'sqlite':
+        # The stored ISO strings, which NumPy parses in bulk far faster
+        # than SQLAlchemy builds datetimes row by row.
+        times = [type_coerce(column, String) for column in times]
+    query = select(stays.c.user_id, stays.c.lot_id, *times, stays.c.cost_per_hour,
+                   *(stays.c[name] for name, _ in extra_fields))
+    dtype = STAY_FIELDS + list(extra_fields)
+    # Plain DBAPI tuples straight into typed arrays: no Row object per stay.
+    cursor = db.session.connection().execute(query).cursor
+    chunks = [np.array([], dtype=dtype)]
+    while rows := cursor.fetchmany(FETCH_SIZE):
+        chunks.append(np.array(rows, dtype=dtype))
+    data = np.concatenate(chunks)
+    seconds = (data['leaving_time'] - data['parking_time']) / np.timedelta64(1, 's')
+    paise = stay_costs(data['parking_time'], data['leaving_time'], data['cost_per_hour'])
+    return month, data, seconds, paise
+
+
+def _names(by, ids):
+    if by == 'user':
+        query = select(User.id, User.username).where(User.id.in_(ids))
+    else:
+        query = select(ParkingLot.id, ParkingLot.prime_location_name).where(ParkingLot.id.in_(ids))
+    return dict(db.session.execute(query).all())
+
+
+def _amount(paise):
+    return int(paise) / 100
+
+
+def invoices(month=None, by='user'):
+    """Month totals for every user or lot with completed stays in it.
+
+    Returns (month, invoices); each invoice has the id, its username or lot
+    name (None for deleted lots), stays, hours, amount (rupees) and
+    amount_paise. Amounts are sums of the per-stay paise, so they match the
+    stay costs shown everywhere else.
+    """
+    import numpy as np
+
+    month, data, seconds, paise = _stays(month)
+    ids, group = np.unique(data[f'{by}_id'], return_inverse=True)
+    stays = np.bincount(group, minlength=len(ids))
+    hours = np.bincount(group, weights=seconds, minlength=len(ids)) / 3600
+    # Summed as int64 rather than as float bincount weights, so totals are exact.
+    totals = np.zeros(len(ids), dtype=np.int64)
+    np.add.at(totals, group, paise)
+
+    names = {}
+    for offset in range(0, len(ids), 500):
+        names.update(_names(by, ids[offset:offset + 500].tolist()))
+    name_field = 'username' if by == 'user' else 'lot_name'
+    return month, [
+        {
+            f'{by}_id': key, name_field: names.get(key), 'stays': int(count),
+            'hours': round(float(total_hours), 2), 'amount': _amount(total), 'amount_paise': int(total),
+        }
+        for key, count, total_hours, total in zip(ids.tolist(), stays, hours, totals)
+    ]
+
+
+def invoice(month=None, by='user', key=None):
+    """One user's or lot's invoice for the month, with a line per stay."""
+    import numpy as np
+
+    month, data, seconds, paise = _stays(month, (('id', 'i8'), ('location', 'O')), **{f'{by}_id': key})
+    order = np.lexsort((data['id'], data['parking_time']))
+    total = int(paise.sum())
+    return {
+        'month': month,
+        f'{by}_id': key,
+        'username' if by == 'user' else 'lot_name': _names(by, [key]).get(key),
+        'stays': len(order),
+        'hours': round(float(seconds.sum()) / 3600, 2),
+        'amount': _amount(total),
+        'amount_paise': total,
+        'lines': [
+            {
+                'reservation_id': int(data['id'][i]),
+                'user_id': int(data['user_id'][i]),
+                'lot_id': int(data['lot_id'][i]),
+                'location': data['location'][i],
+                'parking_time': data['parking_time'][i].item().isoformat(),
+                'leaving_time': data['leaving_time'][i].item().isoformat(),
+                'hours': round(float(seconds[i]) / 3600, 2),
+                'amount': _amount(paise[i]),
+            }
+            for i in order.tolist()
+        ],
+    }
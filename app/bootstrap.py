@@ -0,0 +1,42 @@
+from flask import current_app
+from . import db
+from .database import upgrade_schema
+from .models import User
+
+DEFAULT_ADMIN = ('admin', 'admin123')
+
+
+def migrate():
+    """Bring the schema up to date and run the backfills its changes need.
+
+    Safe to run repeatedly. Returns (created tables, added "table.column"s).
+    """
+    created, added = upgrade_schema(db)
+    if 'parking_lots.available_count' in added:
+        from .occupancy import reconcile_counts
+        reconcile_counts()
+    if 'reservations.lot_id' in added:
+        from .ledger import backfill_lot_ids
+        backfill_lot_ids()
+    if 'lot_usage_daily' in created and 'reservations' not in created:
+        from .rollups import rebuild_rollups
+        rebuild_rollups()
+    from .archive import upgrade_archive_indexes
+    upgrade_archive_indexes()
+    from .search import init_search
+    init_search(current_app)
+    return created, added
+
+
+def seed_admin(username=DEFAULT_ADMIN[0], password=DEFAULT_ADMIN[1]):
+    """Create the admin account unless a user with that name exists.
+
+    Returns True if it was created.
+    """
+    if db.session.scalar(db.select(User.id).where(User.username == username)):
+        return False
+    admin = User(username=username, is_admin=True, email=f'{username}@example.com', full_name='Admin')
+    admin.set_password(password)
+    db.session.add(admin)
+    db.session.commit()
+    return True
@@ -0,0 +1,159 @@
+import csv
+import json
+import os
+import time
+import click
+
+
+def register_commands(app):
+    @app.cli.command('migrate')
+    def migrate_command():
+        """Create missing tables, columns, indexes and search indexes."""
+        from .bootstrap import migrate
+
+        created, added = migrate()
+        click.echo(f'Schema up to date ({len(created)} table(s) created, {len(added)} column(s) added).')
+
+    @app.cli.command('seed-admin')
+    @click.option('--username', default='admin', show_default=True)
+    @click.option('--password', envvar='ADMIN_PASSWORD', default='admin123',
+                  help='Defaults to $ADMIN_PASSWORD, then admin123.')
+    def seed_admin_command(username, password):
+        """Create the admin account if it does not exist yet."""
+        from .bootstrap import seed_admin
+
+        if seed_admin(username, password):
+            click.echo(f'Created admin user {username!r}.')
+        else:
+            click.echo(f'User {username!r} already exists; nothing changed.')
+
+    @app.cli.command('precompile-templates')
+    def precompile_templates_command():
+        """Compile all templates into the bytecode cache (TEMPLATE_CACHE_DIR)."""
+        from flask import current_app
+        from .templating import precompile_templates
+
+        if not current_app.config['TEMPLATE_CACHE_DIR']:
+            raise click.ClickException('The template cache is off; set TEMPLATE_CACHE_DIR.')
+        count = precompile_templates(current_app)
+        click.echo(f'Compiled {count} template(s) into {current_app.config["TEMPLATE_CACHE_DIR"]}.')
+
+    @app.cli.command('reconcile-occupancy')
+    @click.option('--lot-id', type=int, default=None, help='Only reconcile this lot.')
+    def reconcile_occupancy(lot_id):
+        """Rebuild per-lot occupancy counters from parking_spots."""
+        from .occupancy import reconcile_counts
+
+        drifted = reconcile_counts(lot_id)
+        for lot, old_available, old_occupied, available, occupied in drifted:
+            click.echo(
+                f'Lot {lot}: available {old_available} -> {available}, '
+                f'occupied {old_occupied} -> {occupied}'
+            )
+        click.echo(f'Reconciled occupancy counters ({len(drifted)} lot(s) corrected).')
+
+    @app.cli.command('rebuild-rollups')
+    @click.option('--lot-id', type=int, default=None, help='Only rebuild this lot.')
+    def rebuild_usage_rollups(lot_id):
+        """Rebuild hourly and daily lot usage rollups from reservations."""
+        from .rollups import rebuild_rollups
+
+        written = rebuild_rollups(lot_id)
+        click.echo(f'Rebuilt usage rollups ({written} bucket(s) written).')
+
+    @app.cli.command('archive-reservations')
+    @click.option('--older-than-days', type=click.IntRange(min=1), default=None,
+                  help='Defaults to ARCHIVE_AFTER_DAYS (180).')
+    def archive_reservations_command(older_than_days):
+        """Move completed reservations into per-month archive tables."""
+        from flask import current_app
+        from .archive import archive_reservations
+
+        days = older_than_days or current_app.config['ARCHIVE_AFTER_DAYS']
+        started = time.perf_counter()
+        archived = archive_reservations(days)
+        click.echo(f'Archived {archived} reservation(s) that ended over {days} day(s) ago '
+                   f'in {time.perf_counter() - started:.2f}s.')
+
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index_command():
+        """Repopulate the full-text search indexes for users and lots."""
+        from .search import fts_available, rebuild_search_index
+
+        if not fts_available():
+            raise click.ClickException('Full-text search is not available on this database.')
+        rebuild_search_index()
+        click.echo('Rebuilt search indexes.')
+
+    @app.cli.command('calibrate-password-hash')
+    @click.option('--target-ms', type=float, default=250, show_default=True,
+                  help='Desired time to hash or verify one password.')
+    @click.option('--algorithm', type=click.Choice(['pbkdf2', 'scrypt']), default='pbkdf2', show_default=True)
+    def calibrate_password_hash(target_ms, algorithm):
+        """Pick password hashing parameters for this machine.
+
+        Prints a PASSWORD_HASH_METHOD value; existing hashes are upgraded
+        to it as users log in.
+        """
+        from flask import current_app
+        from .passwords import calibrate, time_method
+
+        current = current_app.config['PASSWORD_HASH_METHOD']
+        click.echo(f'Current method {current}: {time_method(current):.0f} ms per hash')
+        method, elapsed = calibrate(algorithm, target_ms)
+        click.echo(f'{method}: {elapsed:.0f} ms per hash (target {target_ms:.0f} ms)')
+        click.echo(f'export PASSWORD_HASH_METHOD={method}')
+
+    @app.cli.command('import-lots')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(['csv', 'json']), default=None,
+                  help='Defaults to the file extension.')
+    def import_lots_command(path, fmt):
+        """Create parking lots (and their spots) from a CSV or JSON file.
+
+        Each record needs name, address, pin_code, price_per_hour and
+        max_spots. All lots are created in one transaction.
+        """
+        from .provisioning import LotValidationError, import_lots
+
+        fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+        with open(path, newline='', encoding='utf-8') as f:
+            if fmt == 'csv':
+                rows = list(csv.DictReader(f))
+            elif fmt == 'json':
+                rows = json.load(f)
+            else:
+                raise click.UsageError('Cannot infer the file format; pass --format csv or json.')
+
+        started = time.perf_counter()
+        try:
+            lots, spots = import_lots(rows)
+        except LotValidationError as e:
+            raise click.ClickException(f'Nothing imported: {e}')
+        elapsed = time.perf_counter() - started
+        click.echo(f'Imported {lots} lot(s) with {spots} spot(s) in {elapsed:.2f}s.')
+
+    @app.cli.command('invoices')
+    @click.option('--month', default=None, help='YYYY-MM; defaults to the last full month.')
+    @click.option('--by', type=click.Choice(['user', 'lot']), default='user', show_default=True)
+    @click.option('--output', type=click.Path(dir_okay=False, writable=True), default=None,
+                  help='CSV file to write; defaults to stdout.')
+    def invoices_command(month, by, output):
+        """Bill a month's completed stays per user or per lot as CSV."""
+        from .billing import BillingError, invoices
+
+        started = time.perf_counter()
+        try:
+            month, items = invoices(month, by)
+        except BillingError as e:
+            raise click.UsageError(str(e))
+        elapsed = time.perf_counter() - started
+        fields = [f'{by}_id', 'username' if by == 'user' else 'lot_name', 'stays', 'hours', 'amount', 'amount_paise']
+        with click.open_file(output or '-', 'w', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=fields, lineterminator='\n')
+            writer.writeheader()
+            writer.writerows(items)
+        stays = sum(item['stays'] for item in items)
+        total = sum(item['amount_paise'] for item in items)
+        click.echo(f'{month}: {len(items)} invoice(s), {stays} stay(s), {total / 100:.2f} total, '
+                   f'computed in {elapsed:.2f}s.', err=True)
@@ -0,0 +1,133 @@
+import importlib
+import os
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import make_url
+
+# Applied on every new SQLite connection. Override any of them through the
+# SQLITE_PRAGMAS config dict or the matching SQLITE_<NAME> environment variable.
+SQLITE_PRAGMA_DEFAULTS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -32000,        # negative = KiB, so ~32 MB of page cache
+    'mmap_size': 268435456,      # 256 MB
+    'busy_timeout': 10000,       # ms to wait on a locked database
+}
+
+POOL_ENV = {
+    'pool_size': 'DB_POOL_SIZE',
+    'max_overflow': 'DB_MAX_OVERFLOW',
+    'pool_timeout': 'DB_POOL_TIMEOUT',
+    'pool_recycle': 'DB_POOL_RECYCLE',
+}
+POOL_DEFAULTS = {'pool_size': 10, 'max_overflow': 20, 'pool_timeout': 30, 'pool_recycle': 1800}
+
+
+def database_config_from_env(app):
+    default_path = os.path.join(app.instance_path, 'parking.db')
+    pragmas = {
+        name: os.environ.get(f'SQLITE_{name.upper()}', value)
+        for name, value in SQLITE_PRAGMA_DEFAULTS.items()
+    }
+    pool = {
+        option: int(os.environ.get(env, POOL_DEFAULTS[option]))
+        for option, env in POOL_ENV.items()
+    }
+    return {
+        'SQLALCHEMY_DATABASE_URI': os.environ.get('DATABASE_URL', f'sqlite:///{default_path}'),
+        'SQLITE_PRAGMAS': pragmas,
+        'DATABASE_POOL': pool,
+    }
+
+
+def dialect_insert(dialect):
+    """The sqlite or postgresql insert() construct, which supports ON CONFLICT.
+
+    Imported on first use so a SQLite deployment never loads the PostgreSQL
+    dialect at startup.
+    """
+    return importlib.import_module(f'sqlalchemy.dialects.{dialect}').insert
+
+
+def _is_sqlite_memory(url):
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def configure_engine_options(app):
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+
+    if url.get_backend_name() == 'sqlite':
+        if url.database and not _is_sqlite_memory(url):
+            os.makedirs(os.path.dirname(os.path.abspath(url.database)), exist_ok=True)
+    else:
+        options.setdefault('pool_pre_ping', True)
+
+    # Flask-SQLAlchemy gives in-memory SQLite a StaticPool, which takes no sizing.
+    if not _is_sqlite_memory(url):
+        for option, value in app.config.get('DATABASE_POOL', {}).items():
+            options.setdefault(option, value)
+
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def install_sqlite_pragmas(app, engine):
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = dict(app.config.get('SQLITE_PRAGMAS', {}))
+    if _is_sqlite_memory(engine.url):
+        pragmas.pop('journal_mode', None)
+        pragmas.pop('mmap_size', None)
+
+    @event.listens_for(engine, 'connect')
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+
+def _is_narrower(existing, wanted):
+    length = getattr(wanted, 'length', None)
+    current = getattr(existing, 'length', None)
+    return length is not None and current is not None and current < length
+
+
+def upgrade_schema(db):
+    """Create missing tables, then add the columns and indexes that
+    create_all() skips on tables that already exist.
+
+    Only additive changes are handled, plus widening string columns whose
+    model length grew (SQLite does not enforce lengths, so only other
+    backends are altered). Returns the names of the tables created and the
+    "table.column" names added.
+    """
+    engine = db.engine
+    existing_tables = set(inspect(engine).get_table_names())
+    db.create_all()
+    created = {table.name for table in db.metadata.sorted_tables} - existing_tables
+    inspector = inspect(engine)
+    added = []
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            columns = {c['name']: c for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in columns:
+                    if engine.dialect.name != 'sqlite' and _is_narrower(columns[column.name]['type'], column.type):
+                        conn.execute(text(f'ALTER TABLE {table.name} ALTER COLUMN {column.name} '
+                                          f'TYPE {column.type.compile(engine.dialect)}'))
+                    continue
+                ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}'
+                default = column.default.arg if column.default is not None and column.default.is_scalar else None
+                if isinstance(default, bool):
+                    default = int(default)
+                if default is not None:
+                    ddl += f' DEFAULT {default!r}'
+                if not column.nullable and default is not None:
+                    ddl += ' NOT NULL'
+                conn.execute(text(ddl))
+                added.append(f'{table.name}.{column.name}')
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+    return created, added
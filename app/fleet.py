@@ -0,0 +1,158 @@
+from datetime import datetime
+from sqlalchemy import insert, select, update
+from . import db, rollups
+from .allocator import claim_spots, free_spots
+from .models import ParkingLot, ParkingSpot, Reservation, stay_cost
+
+MAX_BATCH_SIZE = 50
+MAX_BATCH_LOTS = 5
+
+# all_or_nothing: any shortfall or failure rolls the whole batch back.
+# partial: whatever can be done is committed and the rest is reported.
+MODES = ('all_or_nothing', 'partial')
+
+
+class BatchError(ValueError):
+    pass
+
+
+def batch_mode(data):
+    mode = data.get('mode', 'all_or_nothing')
+    if mode not in MODES:
+        raise BatchError(f'mode must be one of: {", ".join(MODES)}')
+    return mode
+
+
+def _ids(values, name, limit):
+    if not isinstance(values, list) or not values:
+        raise BatchError(f'{name} must be a non-empty list of ids')
+    try:
+        ids = list(dict.fromkeys(int(value) for value in values))
+    except (TypeError, ValueError):
+        raise BatchError(f'{name} must be a non-empty list of ids')
+    if len(ids) > limit:
+        raise BatchError(f'at most {limit} {name} per batch')
+    return ids
+
+
+def parse_reserve(data):
+    """Validate a batch reservation body; returns (lot_ids, count, mode)."""
+    lot_ids = data.get('lot_ids')
+    if lot_ids is None and data.get('lot_id') is not None:
+        lot_ids = [data['lot_id']]
+    lot_ids = _ids(lot_ids, 'lot_ids', MAX_BATCH_LOTS)
+    try:
+        count = int(data.get('count'))
+        if not (1 <= count <= MAX_BATCH_SIZE):
+            raise ValueError
+    except (TypeError, ValueError):
+        raise BatchError(f'count must be between 1 and {MAX_BATCH_SIZE}')
+    return lot_ids, count, batch_mode(data)
+
+
+def parse_release(data):
+    """Validate a batch release body; returns (reservation_ids, mode)."""
+    return _ids(data.get('reservation_ids'), 'reservation_ids', MAX_BATCH_SIZE), batch_mode(data)
+
+
+def reserve_batch(user_id, lot_ids, count, mode):
+    """Reserve count spots for one user, filling lot_ids in preference order.
+
+    Returns (reserved, shortfall) where reserved lists
+    {'reservation_id', 'spot_id', 'lot_id'}. In all_or_nothing mode a
+    shortfall rolls everything back and reserved is empty. Commits on
+    success; raises BatchError for unknown lots.
+    """
+    prices = dict(db.session.execute(
+        select(ParkingLot.id, ParkingLot.price_per_hour).where(ParkingLot.id.in_(lot_ids))
+    ).all())
+    unknown = [lot_id for lot_id in lot_ids if lot_id not in prices]
+    if unknown:
+        raise BatchError(f'unknown lot id(s): {", ".join(map(str, unknown))}')
+
+    claimed = claim_spots(lot_ids, count)
+    spots = [(lot_id, spot_id) for lot_id, spot_ids in claimed.items() for spot_id in spot_ids]
+    shortfall = count - len(spots)
+    if not spots or (shortfall and mode == 'all_or_nothing'):
+        db.session.rollback()
+        return [], count
+
+    parking_time = datetime.utcnow()
+    reservation_ids = db.session.scalars(
+        insert(Reservation).returning(Reservation.id, sort_by_parameter_order=True),
+        [
+            {'user_id': user_id, 'spot_id': spot_id, 'lot_id': lot_id, 'parking_time': parking_time,
+             'cost_per_hour': prices[lot_id]}
+            for lot_id, spot_id in spots
+        ],
+    ).all()
+    rollups.record_reservations(list(claimed), parking_time)
+    db.session.commit()
+    return [
+        {'reservation_id': reservation_id, 'spot_id': spot_id, 'lot_id': lot_id}
+        for reservation_id, (lot_id, spot_id) in zip(reservation_ids, spots)
+    ], shortfall
+
+
+def release_batch(user_id, reservation_ids, mode):
+    """Close many of one user's active reservations in one transaction.
+
+    Returns (released, failed): released lists {'reservation_id', 'spot_id',
+    'lot_id', 'cost'}, failed lists {'reservation_id', 'reason'} with reason
+    'not_found' (missing or someone else's) or 'already_released'. In
+    all_or_nothing mode any failure releases nothing.
+    """
+    rows = {row.id: row for row in db.session.execute(
+        select(Reservation.id, Reservation.user_id, Reservation.spot_id, Reservation.parking_time,
+               Reservation.leaving_time, Reservation.cost_per_hour, ParkingSpot.lot_id)
+        .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id)
+        .where(Reservation.id.in_(reservation_ids))
+    )}
+    failed = {}
+    for reservation_id in reservation_ids:
+        row = rows.get(reservation_id)
+        if row is None or row.user_id != user_id:
+            failed[reservation_id] = 'not_found'
+        elif row.leaving_time:
+            failed[reservation_id] = 'already_released'
+    open_ids = [reservation_id for reservation_id in reservation_ids if reservation_id not in failed]
+
+    released_ids = []
+    if open_ids and not (failed and mode == 'all_or_nothing'):
+        leaving_time = datetime.utcnow()
+        # A concurrent single release can still win the race for some rows.
+        released_ids = set(db.session.scalars(
+            update(Reservation)
+            .where(Reservation.id.in_(open_ids), Reservation.leaving_time.is_(None))
+            .values(leaving_time=leaving_time)
+            .returning(Reservation.id)
+            .execution_options(synchronize_session=False)
+        ).all())
+        for reservation_id in open_ids:
+            if reservation_id not in released_ids:
+                failed[reservation_id] = 'already_released'
+        if failed and mode == 'all_or_nothing':
+            released_ids = []
+
+    failures = [{'reservation_id': reservation_id, 'reason': reason} for reservation_id, reason in failed.items()]
+    if not released_ids:
+        db.session.rollback()
+        return [], failures
+
+    released = []
+    for reservation_id in open_ids:
+        if reservation_id in released_ids:
+            row = rows[reservation_id]
+            released.append({
+                'reservation_id': reservation_id,
+                'spot_id': row.spot_id,
+                'lot_id': row.lot_id,
+                'cost': stay_cost(row.parking_time, leaving_time, row.cost_per_hour),
+            })
+    free_spots([item['spot_id'] for item in released])
+    rollups.record_releases(
+        (item['lot_id'], rows[item['reservation_id']].parking_time, leaving_time, item['cost'])
+        for item in released
+    )
+    db.session.commit()
+    return released, failures
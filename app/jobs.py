@@ -0,0 +1,447 @@
+import csv
+import importlib.util
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete, func, select, update
+from . import db, rollups
+from .models import Job, ParkingLot, ParkingSpot, Reservation, User, stay_cost
+from .response_cache import bump
+from .spot_events import record_lot_reshaped
+
+DEFAULT_WORKERS = 2
+CHUNK_SIZE = 1000
+# A running job that has not reported progress for this long was most likely
+# lost with the process that ran it; cancelling it marks it failed.
+STALE_SECONDS = 300
+FINISHED = ('succeeded', 'failed', 'cancelled')
+
+_kinds = {}
+
+
+class JobError(ValueError):
+    pass
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def job(kind, check=None):
+    """Register a job handler, handler(ctx, **params) -> JSON-able result.
+
+    check(params) runs in the submitting request and returns the params to
+    store, raising JobError to refuse the job.
+    """
+    def decorator(f):
+        _kinds[kind] = (f, check)
+        return f
+    return decorator
+
+
+class JobContext:
+    def __init__(self, job_id, results_dir):
+        self.job_id = job_id
+        self.results_dir = results_dir
+
+    def progress(self, done, total=None):
+        """Record progress and commit; raises JobCancelled if cancellation
+        was requested. Call only between the handler's own transactions.
+        """
+        values = {'progress': done, 'updated_at': datetime.utcnow()}
+        if total is not None:
+            values['total'] = total
+        cancel = db.session.scalar(
+            update(Job)
+            .where(Job.id == self.job_id)
+            .values(**values)
+            .returning(Job.cancel_requested)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        if cancel:
+            raise JobCancelled()
+
+    def result_path(self, extension):
+        os.makedirs(self.results_dir, exist_ok=True)
+        return os.path.join(self.results_dir, f'job-{self.job_id}.{extension}')
+
+
+class JobRunner:
+    """Runs admin jobs on a small thread pool in this process.
+
+    The jobs table is the source of truth for status, progress and results,
+    so any worker process can report on or cancel a job; only the process
+    that accepted a job runs it.
+    """
+
+    def __init__(self, app, workers, results_dir):
+        self._app = app
+        self._workers = workers
+        self.results_dir = results_dir
+        self._executor = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, kind, params, user_id=None):
+        """Queue a job and return its row; raises JobError for bad params.
+
+        Commits the job row before the worker can pick it up.
+        """
+        if kind not in _kinds:
+            raise JobError(f'unknown job kind: {kind}')
+        _, check = _kinds[kind]
+        params = check(params or {}) if check else (params or {})
+        row = Job(kind=kind, params=json.dumps(params), created_by=user_id, updated_at=datetime.utcnow())
+        db.session.add(row)
+        db.session.commit()
+        with self._start_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self._workers, thread_name_prefix='job')
+        self._executor.submit(self._run, row.id)
+        return row
+
+    def cancel(self, job_id):
+        """Cancel a queued job now, or ask a running one to stop at its next
+        progress report. Returns False if the job already finished.
+        """
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=current_app.config['JOB_STALE_SECONDS'])
+        transitions = (
+            (Job.status == 'queued', {'status': 'cancelled', 'finished_at': now}),
+            ((Job.status == 'running') & (Job.updated_at < stale),
+             {'status': 'failed', 'message': 'Interrupted: the process running it stopped.', 'finished_at': now}),
+            (Job.status == 'running', {'cancel_requested': True}),
+        )
+        for condition, values in transitions:
+            changed = db.session.execute(
+                update(Job)
+                .where(Job.id == job_id, condition)
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if changed:
+                db.session.commit()
+                return True
+        return False
+
+    def _finish(self, job_id, **values):
+        db.session.execute(
+            update(Job)
+            .where(Job.id == job_id)
+            .values(finished_at=datetime.utcnow(), updated_at=datetime.utcnow(), **values)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+    def _run(self, job_id):
+        with self._app.app_context():
+            now = datetime.utcnow()
+            started = db.session.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == 'queued')
+                .values(status='running', started_at=now, updated_at=now)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            db.session.commit()
+            if not started:
+                return  # cancelled while queued
+            kind, params = db.session.execute(select(Job.kind, Job.params).where(Job.id == job_id)).one()
+            handler, _ = _kinds[kind]
+            try:
+                result = handler(JobContext(job_id, self.results_dir), **json.loads(params))
+            except JobCancelled:
+                db.session.rollback()
+                self._finish(job_id, status='cancelled', message='Cancelled.')
+            except Exception as e:
+                db.session.rollback()
+                if not isinstance(e, JobError):
+                    self._app.logger.exception('Job %s (%s) failed', job_id, kind)
+                self._finish(job_id, status='failed', message=str(e)[:500] or type(e).__name__)
+            else:
+                self._finish(job_id, status='succeeded', result=json.dumps(result),
+                             progress=func.coalesce(Job.total, Job.progress))
+
+
+def init_jobs(app):
+    app.config.setdefault('JOB_WORKERS', int(os.environ.get('JOB_WORKERS', DEFAULT_WORKERS)))
+    app.config.setdefault('JOB_RESULTS_DIR',
+                          os.environ.get('JOB_RESULTS_DIR', os.path.join(app.instance_path, 'job-results')))
+    app.config.setdefault('JOB_STALE_SECONDS', int(os.environ.get('JOB_STALE_SECONDS', STALE_SECONDS)))
+    app.extensions['jobs'] = JobRunner(app, app.config['JOB_WORKERS'], app.config['JOB_RESULTS_DIR'])
+
+
+def current_jobs():
+    return current_app.extensions['jobs']
+
+
+def job_json(row):
+    result = json.loads(row.result) if row.result else None
+    return {
+        'id': row.id,
+        'kind': row.kind,
+        'status': row.status,
+        'progress': row.progress,
+        'total': row.total,
+        'message': row.message,
+        'result': result,
+        'cancel_requested': row.cancel_requested,
+        'created_at': row.created_at.isoformat() if row.created_at else None,
+        'started_at': row.started_at.isoformat() if row.started_at else None,
+        'finished_at': row.finished_at.isoformat() if row.finished_at else None,
+        'download': bool(result and result.get('file')),
+    }
+
+
+def _int_param(params, name, required=True):
+    value = params.get(name)
+    if value in (None, '') and not required:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise JobError(f'{name} must be an integer')
+
+
+def _check_delete_lot(params):
+    lot_id = _int_param(params, 'lot_id')
+    if db.session.get(ParkingLot, lot_id) is None:
+        raise JobError('Parking lot not found.')
+    occupied = db.session.scalar(
+        select(ParkingSpot.id).where(ParkingSpot.lot_id == lot_id, ParkingSpot.status == 'O').limit(1)
+    )
+    if occupied:
+        raise JobError('Cannot delete lot with occupied spots.')
+    return {'lot_id': lot_id}
+
+
+@job('delete_lot', _check_delete_lot)
+def delete_lot(ctx, lot_id):
+    """Delete a lot, its spots and their reservations in chunks.
+
+    The first transaction takes every free spot out of service (status 'D'),
+    so nothing can be booked in the lot while the rest is deleted. Usage
+    rollups are history and are kept. Cancelling puts the remaining spots
+    back in service and shrinks the lot to them, as does a failure part way.
+    """
+    db.session.execute(
+        update(ParkingSpot)
+        .where(ParkingSpot.lot_id == lot_id, ParkingSpot.status == 'A')
+        .values(status='D')
+        .execution_options(synchronize_session=False)
+    )
+    occupied = db.session.scalar(
+        select(func.count(ParkingSpot.id)).where(ParkingSpot.lot_id == lot_id, ParkingSpot.status == 'O')
+    )
+    if occupied:
+        raise JobError('Cannot delete lot with occupied spots.')
+    db.session.execute(
+        update(ParkingLot)
+        .where(ParkingLot.id == lot_id)
+        .values(available_count=0, spot_version=ParkingLot.spot_version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    record_lot_reshaped(db.session, lot_id)
+    bump('lots')
+    db.session.commit()
+
+    total = db.session.scalar(select(func.count(ParkingSpot.id)).where(ParkingSpot.lot_id == lot_id))
+    spots_deleted = reservations_deleted = 0
+    try:
+        ctx.progress(0, total)
+        while True:
+            spot_ids = db.session.scalars(
+                select(ParkingSpot.id).where(ParkingSpot.lot_id == lot_id).order_by(ParkingSpot.id).limit(CHUNK_SIZE)
+            ).all()
+            if not spot_ids:
+                break
+            reservations_deleted += db.session.execute(
+                delete(Reservation).where(Reservation.spot_id.in_(spot_ids))
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            spots_deleted += db.session.execute(
+                delete(ParkingSpot).where(ParkingSpot.id.in_(spot_ids))
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            db.session.commit()
+            ctx.progress(spots_deleted)
+    except Exception:
+        db.session.rollback()
+        _restore_lot(lot_id)
+        raise
+
+    db.session.execute(delete(ParkingLot).where(ParkingLot.id == lot_id).execution_options(synchronize_session=False))
+    record_lot_reshaped(db.session, lot_id)
+    bump('lots')
+    db.session.commit()
+    return {'lot_id': lot_id, 'spots_deleted': spots_deleted, 'reservations_deleted': reservations_deleted}
+
+
+def _restore_lot(lot_id):
+    db.session.execute(
+        update(ParkingSpot)
+        .where(ParkingSpot.lot_id == lot_id, ParkingSpot.status == 'D')
+        .values(status='A')
+        .execution_options(synchronize_session=False)
+    )
+    remaining = select(func.count(ParkingSpot.id)).where(ParkingSpot.lot_id == lot_id).scalar_subquery()
+    available = (
+        select(func.count(ParkingSpot.id))
+        .where(ParkingSpot.lot_id == lot_id, ParkingSpot.status == 'A')
+        .scalar_subquery()
+    )
+    db.session.execute(
+        update(ParkingLot)
+        .where(ParkingLot.id == lot_id)
+        .values(max_spots=remaining, available_count=available, spot_version=ParkingLot.spot_version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    record_lot_reshaped(db.session, lot_id)
+    bump('lots')
+    db.session.commit()
+
+
+def _check_import_lots(params):
+    rows = params.get('rows')
+    if not isinstance(rows, list) or not rows or not all(isinstance(row, dict) for row in rows):
+        raise JobError('rows must be a non-empty list of lot objects')
+    return {'rows': rows}
+
+
+@job('import_lots', _check_import_lots)
+def import_lots(ctx, rows):
+    # One transaction, as in the import-lots command: all rows or none.
+    from .provisioning import LotValidationError, import_lots as create_lots
+
+    ctx.progress(0, len(rows))
+    try:
+        lots, spots = create_lots(rows)
+    except LotValidationError as e:
+        raise JobError(f'Nothing imported: {e}')
+    return {'lots_created': lots, 'spots_created': spots}
+
+
+EXPORT_COLUMNS = ('reservation_id', 'username', 'lot', 'spot_id', 'parking_time', 'leaving_time',
+                  'cost_per_hour', 'cost')
+
+
+def _check_export(params):
+    fmt = params.get('format', 'csv')
+    if fmt not in ('csv', 'xlsx'):
+        raise JobError('format must be csv or xlsx')
+    if fmt == 'xlsx' and importlib.util.find_spec('openpyxl') is None:
+        raise JobError('xlsx exports need the openpyxl package (pip install openpyxl).')
+    checked = {'format': fmt}
+    for name in ('since', 'until'):
+        if params.get(name):
+            try:
+                checked[name] = datetime.fromisoformat(params[name]).isoformat()
+            except (TypeError, ValueError):
+                raise JobError(f'{name} must be an ISO date')
+    return checked
+
+
+class _XlsxWriter:
+    def __init__(self, path):
+        from openpyxl import Workbook
+
+        self._path = path
+        self._book = Workbook(write_only=True)
+        self._sheet = self._book.create_sheet('Reservations')
+
+    def writerow(self, row):
+        self._sheet.append(list(row))
+
+    def close(self):
+        self._book.save(self._path)
+
+
+@job('export_reservations', _check_export)
+def export_reservations(ctx, format='csv', since=None, until=None):
+    """Write every matching reservation, archived ones included, to a CSV
+    or Excel file, a page of CHUNK_SIZE rows at a time (keyset on the id).
+    """
+    from .archive import history
+
+    since = datetime.fromisoformat(since) if since else None
+    until = datetime.fromisoformat(until) if until else None
+    stays = history(since=since, until=until)
+    query = (
+        select(stays.c.id, User.username, stays.c.location, stays.c.spot_id,
+               stays.c.parking_time, stays.c.leaving_time, stays.c.cost_per_hour)
+        .join(User, stays.c.user_id == User.id)
+        .order_by(stays.c.id)
+        .limit(CHUNK_SIZE)
+    )
+    ctx.progress(0, db.session.scalar(select(func.count()).select_from(stays)))
+
+    path = ctx.result_path(format)
+    if format == 'csv':
+        f = open(path, 'w', newline='', encoding='utf-8')
+        writer, close = csv.writer(f), f.close
+    else:
+        writer = _XlsxWriter(path)
+        close = writer.close
+    written, last_id = 0, 0
+    try:
+        writer.writerow(EXPORT_COLUMNS)
+        while True:
+            rows = db.session.execute(query.where(stays.c.id > last_id)).all()
+            if not rows:
+                break
+            for row in rows:
+                writer.writerow((row.id, row.username, row.location, row.spot_id,
+                                 row.parking_time.isoformat(),
+                                 row.leaving_time.isoformat() if row.leaving_time else '',
+                                 row.cost_per_hour,
+                                 stay_cost(row.parking_time, row.leaving_time, row.cost_per_hour)))
+            written += len(rows)
+            last_id = rows[-1].id
+            ctx.progress(written)
+        close()
+    except BaseException:
+        close()
+        os.remove(path)
+        raise
+    return {'file': os.path.basename(path), 'format': format, 'rows': written}
+
+
+def _check_rebuild_rollups(params):
+    lot_id = _int_param(params, 'lot_id', required=False)
+    return {'lot_id': lot_id} if lot_id is not None else {}
+
+
+@job('rebuild_rollups', _check_rebuild_rollups)
+def rebuild_usage_rollups(ctx, lot_id=None):
+    """Rebuild usage rollups one lot per transaction, so the job can be
+    cancelled between lots. Unlike the full rebuild-rollups command, rows
+    of lots that no longer exist are left alone.
+    """
+    if lot_id is not None:
+        lot_ids = [lot_id]
+    else:
+        lot_ids = db.session.scalars(select(ParkingLot.id).order_by(ParkingLot.id)).all()
+    ctx.progress(0, len(lot_ids))
+    written = 0
+    for done, current in enumerate(lot_ids, start=1):
+        written += rollups.rebuild_rollups(current)
+        ctx.progress(done)
+    return {'lots': len(lot_ids), 'buckets_written': written}
+
+
+def _check_archive(params):
+    days = _int_param(params, 'older_than_days', required=False)
+    if days is None:
+        days = current_app.config['ARCHIVE_AFTER_DAYS']
+    if days < 1:
+        raise JobError('older_than_days must be at least 1')
+    return {'older_than_days': days}
+
+
+@job('archive_reservations', _check_archive)
+def archive_old_reservations(ctx, older_than_days):
+    from .archive import archive_reservations
+
+    return {'archived': archive_reservations(older_than_days, ctx.progress)}
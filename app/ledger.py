@@ -0,0 +1,72 @@
+from datetime import datetime
+from sqlalchemy import func, select, update
+from . import db
+from .archive import archived_months, history
+from .models import ParkingSpot, Reservation, User
+from .pagination import fetch_page
+
+PAGE_SIZE = 50
+# Counting stops here: the ledger shows "1000+" rather than scanning the
+# whole history for an exact total on every page.
+COUNT_CAP = 1000
+STATUSES = ('active', 'completed')
+
+
+def backfill_lot_ids():
+    # reservations.lot_id was added after the fact; copy it from the spots once.
+    db.session.execute(
+        update(Reservation)
+        .where(Reservation.lot_id.is_(None))
+        .values(lot_id=select(ParkingSpot.lot_id).where(ParkingSpot.id == Reservation.spot_id).scalar_subquery())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def parse_filters(args):
+    """Ledger filters from query args, as keyword arguments for history().
+
+    `user` is a username or a user id. Values that do not parse are ignored;
+    an unknown username matches nothing. The archive months in range are
+    looked up here once, so the page and the count share them.
+    """
+    filters = {
+        'lot_id': args.get('lot_id', type=int),
+        'since': args.get('since', type=datetime.fromisoformat),
+        'until': args.get('until', type=datetime.fromisoformat),
+    }
+    status = args.get('status')
+    if status in STATUSES:
+        filters[status] = True
+    user = (args.get('user') or '').strip()
+    if user.isdigit():
+        filters['user_id'] = int(user)
+    elif user:
+        filters['user_id'] = db.session.scalar(select(User.id).where(User.username == user)) or 0
+    if not filters.get('active'):
+        filters['months'] = archived_months(filters.get('since'), filters.get('until'))
+    return {name: value for name, value in filters.items() if value is not None}
+
+
+def ledger_page(filters, limit=PAGE_SIZE, after=None):
+    """One page of reservations, newest first; returns (rows, next_cursor).
+
+    The cursor is the (parking_time, id) of the last row. Rows carry the
+    history() columns plus the user's username and full_name.
+    """
+    stays = history(**filters, before=after, limit=limit + 1)
+    query = (
+        select(stays, User.username, User.full_name)
+        .join(User, stays.c.user_id == User.id)
+        .order_by(stays.c.parking_time.desc(), stays.c.id.desc())
+    )
+    return fetch_page(query, limit, lambda row: [row.parking_time, row.id])
+
+
+def estimate_count(filters):
+    """(count, capped): the number of matching reservations, stopping at COUNT_CAP."""
+    stays = history(**filters, limit=COUNT_CAP + 1)
+    count = db.session.scalar(
+        select(func.count()).select_from(select(stays.c.id).limit(COUNT_CAP + 1).subquery())
+    )
+    return min(count, COUNT_CAP), count > COUNT_CAP
@@ -0,0 +1,147 @@
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from flask import current_app, has_app_context
+from sqlalchemy import select
+from . import db
+from .models import ParkingLot
+from .spot_events import on_spot_changes
+
+COALESCE_SECONDS = 0.25
+REFRESH_SECONDS = 2.0
+
+
+class AvailabilityHub:
+    """Fan-out of per-lot availability to long-lived listeners.
+
+    One background thread per process reloads the lot counters (a single
+    query) after local reserve/release commits, waiting COALESCE_SECONDS so
+    a burst becomes one update, and every REFRESH_SECONDS while anyone is
+    listening to catch commits made by other workers. Listeners only block
+    on a condition variable; none of them touch the database.
+
+    Sequence numbers count this hub's reloads, so clients get them as
+    "<epoch>:<seq>" tokens; a token minted by another worker or an earlier
+    process carries a different epoch and is never read as one of ours.
+    """
+
+    def __init__(self, app, coalesce=COALESCE_SECONDS, refresh=REFRESH_SECONDS):
+        self._app = app
+        self._coalesce = coalesce
+        self._refresh = refresh
+        self._changed = threading.Condition()
+        self._dirty = threading.Event()
+        self._seq = 0
+        self.epoch = uuid.uuid4().hex[:12]
+        self._lots = {}
+        self._loaded = False
+        self._listeners = 0
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def token(self, seq):
+        return f'{self.epoch}:{seq}'
+
+    def parse_token(self, token):
+        """The seq in a token from this hub, else None (foreign or malformed)."""
+        epoch, _, seq = (token or '').partition(':')
+        if epoch != self.epoch or not seq.isdigit() or int(seq) > self._seq:
+            return None
+        return int(seq)
+
+    def notify(self):
+        self._dirty.set()
+
+    def _reload(self):
+        rows = db.session.execute(
+            select(ParkingLot.id, ParkingLot.spot_version, ParkingLot.available_count,
+                   ParkingLot.occupied_count, ParkingLot.max_spots)
+        ).all()
+        with self._changed:
+            seq = self._seq + 1
+            changed = False
+            seen = set()
+            for lot_id, version, available, occupied, total in rows:
+                seen.add(lot_id)
+                current = self._lots.get(lot_id)
+                if current is None or current['version'] != version or current.get('deleted'):
+                    self._lots[lot_id] = {'id': lot_id, 'version': version, 'available': available,
+                                          'occupied': occupied, 'total': total, 'seq': seq}
+                    changed = True
+            for lot_id, current in self._lots.items():
+                if lot_id not in seen and not current.get('deleted'):
+                    self._lots[lot_id] = {'id': lot_id, 'deleted': True, 'version': None, 'seq': seq}
+                    changed = True
+            if changed:
+                self._seq = seq
+                self._changed.notify_all()
+            self._loaded = True
+
+    def _run(self):
+        while True:
+            if self._dirty.wait(self._refresh if self._listeners else None):
+                time.sleep(self._coalesce)
+            self._dirty.clear()
+            try:
+                with self._app.app_context():
+                    self._reload()
+            except Exception:
+                self._app.logger.exception('Availability refresh failed')
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if not self._loaded:
+                self._reload()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='availability-hub', daemon=True)
+                self._thread.start()
+
+    def snapshot(self):
+        self._ensure_started()
+        with self._changed:
+            return self._seq, [self._public(lot) for lot in self._lots.values() if not lot.get('deleted')]
+
+    def changes_since(self, seq):
+        with self._changed:
+            return self._seq, [self._public(lot) for lot in self._lots.values() if lot['seq'] > seq]
+
+    def wait(self, seq, timeout):
+        """Block until something changed after seq (or timeout); return the changes."""
+        self._ensure_started()
+        with self._changed:
+            self._changed.wait_for(lambda: self._seq > seq, timeout)
+        return self.changes_since(seq)
+
+    @contextmanager
+    def listening(self):
+        with self._changed:
+            self._listeners += 1
+        self._dirty.set()  # wake the refresher so it starts reloading periodically
+        try:
+            yield
+        finally:
+            with self._changed:
+                self._listeners -= 1
+
+    @staticmethod
+    def _public(lot):
+        return {key: value for key, value in lot.items() if key not in ('seq', 'version')}
+
+
+def init_availability_hub(app):
+    app.extensions['availability_hub'] = AvailabilityHub(app)
+
+
+def current_hub():
+    return current_app.extensions['availability_hub']
+
+
+@on_spot_changes
+def _notify_current_app(changes):
+    if has_app_context() and 'availability_hub' in current_app.extensions:
+        current_hub().notify()
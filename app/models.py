@@ -1,7 +1,9 @@
+import math
 from datetime import datetime
 from . import db
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import check_password_hash
+from .passwords import hash_password
 
 
 class User(UserMixin, db.Model):
@@ -10,37 +12,56 @@ class User(UserMixin, db.Model):
     username = db.Column(db.String(64), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     full_name = db.Column(db.String(120), nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
+    # Room for any configured method: scrypt hashes run to ~162 characters.
+    password_hash = db.Column(db.String(255), nullable=False)
+    # Bumped when the password changes (not when its hash is upgraded); part
+    # of the session id, so a password change signs out other sessions.
+    password_version = db.Column(db.Integer, nullable=False, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_admin =  db.Column(db.Boolean, default=False)
     reservations = db.relationship('Reservation', backref='user', lazy=True, cascade="all, delete-orphan")
      
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
+        self.password_version = (self.password_version or 0) + 1
 
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    def get_id(self):
+        return f'{self.id}:{self.password_version}'
+
 class ParkingLot(db.Model):
     __tablename__ = 'parking_lots'
+    __table_args__ = (
+        db.Index('ix_parking_lots_pin_code', 'pin_code'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     prime_location_name = db.Column(db.String(100), nullable=False)
     address = db.Column(db.String(200), nullable=False)
     pin_code = db.Column(db.String(6), nullable=False)
     price_per_hour = db.Column(db.Float, nullable=False)
     max_spots = db.Column(db.Integer, nullable=False)
+    # Maintained by app.occupancy alongside every spot status change
+    available_count = db.Column(db.Integer, nullable=False, default=0)
+    occupied_count = db.Column(db.Integer, nullable=False, default=0)
+    # Bumped on every spot status or capacity change (see app.spotmap)
+    spot_version = db.Column(db.Integer, nullable=False, default=0)
     spots = db.relationship('ParkingSpot', backref='lot', lazy=True, cascade="all, delete-orphan")
 
     @property
     def available_spots(self):
-        return len([spot for spot in self.spots if spot.status == 'A'])
+        return self.available_count
 
     @property
     def occupied_spots(self):
-        return len([spot for spot in self.spots if spot.status == 'O'])
+        return self.occupied_count
 
 class ParkingSpot(db.Model):
     __tablename__ = 'parking_spots'
+    __table_args__ = (
+        db.Index('ix_parking_spots_lot_status', 'lot_id', 'status'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     lot_id = db.Column(db.Integer, db.ForeignKey('parking_lots.id'), nullable=False)
     status = db.Column(db.String(1), default='A')  # A - Available, O - Occupied
@@ -51,15 +72,114 @@ class ParkingSpot(db.Model):
 
 class Reservation(db.Model):
     __tablename__ = 'reservations'
+    __table_args__ = (
+        db.Index('ix_reservations_leaving_time', 'leaving_time'),
+        # A user's active (leaving_time NULL) and completed stays, newest first
+        db.Index('ix_reservations_user_history', 'user_id', 'leaving_time', 'parking_time'),
+        # Admin ledger (app.ledger): newest first, optionally for one user or lot
+        db.Index('ix_reservations_parking_time', 'parking_time'),
+        db.Index('ix_reservations_user_parked', 'user_id', 'parking_time'),
+        db.Index('ix_reservations_lot_parked', 'lot_id', 'parking_time'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     spot_id = db.Column(db.Integer, db.ForeignKey('parking_spots.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    # Copied from the spot so the ledger can filter by lot through an index
+    lot_id = db.Column(db.Integer)
     parking_time = db.Column(db.DateTime, default=datetime.utcnow)
     leaving_time = db.Column(db.DateTime)
     cost_per_hour = db.Column(db.Float)
 
     def calculate_total_cost(self):
-        if not self.leaving_time:
-            return 0
-        duration = (self.leaving_time - self.parking_time).total_seconds() / 3600  # hours
-        return round(duration * self.cost_per_hour, 2)
+        return stay_cost(self.parking_time, self.leaving_time, self.cost_per_hour)
+
+
+def stay_cost_paise(parking_time, leaving_time, cost_per_hour):
+    # The one rounding rule for money: each stay is rounded to whole paise,
+    # half up, and totals are sums of those. billing.stay_costs() does the
+    # same float operations in the same order, so both agree to the paisa.
+    seconds = (leaving_time - parking_time).total_seconds()
+    return math.floor(seconds * cost_per_hour * 100 / 3600 + 0.5)
+
+
+def stay_cost(parking_time, leaving_time, cost_per_hour):
+    if not leaving_time:
+        return 0
+    return stay_cost_paise(parking_time, leaving_time, cost_per_hour) / 100
+
+
+# Rollup buckets are history: they keep a plain lot_id so revenue for a
+# deleted lot still shows up in reports.
+class HourlyLotUsage(db.Model):
+    __tablename__ = 'lot_usage_hourly'
+    __table_args__ = (
+        db.Index('ix_lot_usage_hourly_bucket', 'bucket_start'),
+    )
+    lot_id = db.Column(db.Integer, primary_key=True)
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+    completed_stays = db.Column(db.Integer, nullable=False, default=0)
+    occupied_hours = db.Column(db.Float, nullable=False, default=0)
+    peak_occupancy = db.Column(db.Integer, nullable=False, default=0)
+
+
+class DailyLotUsage(db.Model):
+    __tablename__ = 'lot_usage_daily'
+    __table_args__ = (
+        db.Index('ix_lot_usage_daily_bucket', 'bucket_start'),
+    )
+    lot_id = db.Column(db.Integer, primary_key=True)
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+    completed_stays = db.Column(db.Integer, nullable=False, default=0)
+    occupied_hours = db.Column(db.Float, nullable=False, default=0)
+    peak_occupancy = db.Column(db.Integer, nullable=False, default=0)
+
+
+# Version counters for cached pages and payloads (see app.response_cache).
+class CacheVersion(db.Model):
+    __tablename__ = 'cache_versions'
+    name = db.Column(db.String(32), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+# Background admin work (see app.jobs). created_by is a plain id, like the
+# rollups, so the job log outlives the admin account that started it.
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_status', 'status'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(32), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='queued')  # queued, running, succeeded, failed, cancelled
+    params = db.Column(db.Text)  # JSON
+    result = db.Column(db.Text)  # JSON
+    message = db.Column(db.String(500))
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    created_by = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+
+# Catalog of the per-month reservations_archive_YYYY_MM tables that
+# app.archive creates on demand, so history queries only touch the months
+# in their date range.
+class ReservationArchive(db.Model):
+    __tablename__ = 'reservation_archives'
+    month = db.Column(db.String(7), primary_key=True)  # YYYY-MM of parking_time
+    table_name = db.Column(db.String(64), nullable=False)
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+# Archived stays per user, so reservation counts stay whole without
+# reading the archive tables.
+class ArchivedReservationCount(db.Model):
+    __tablename__ = 'archived_reservation_counts'
+    user_id = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,85 @@
+from sqlalchemy import case, func, select, update
+from . import db
+from .models import ParkingLot, ParkingSpot
+
+
+def adjust_counts(lot_id, occupied_delta):
+    # Runs inside the caller's transaction so the counters commit together
+    # with the spot status change they describe.
+    db.session.execute(
+        update(ParkingLot)
+        .where(ParkingLot.id == lot_id)
+        .values(
+            occupied_count=ParkingLot.occupied_count + occupied_delta,
+            available_count=ParkingLot.available_count - occupied_delta,
+            spot_version=ParkingLot.spot_version + 1,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _spot_count(status):
+    return (
+        select(func.count(ParkingSpot.id))
+        .where(ParkingSpot.lot_id == ParkingLot.id, ParkingSpot.status == status)
+        .scalar_subquery()
+    )
+
+
+def reconcile_counts(lot_id=None):
+    available = _spot_count('A')
+    occupied = _spot_count('O')
+
+    drift_query = select(
+        ParkingLot.id,
+        ParkingLot.available_count,
+        ParkingLot.occupied_count,
+        available,
+        occupied,
+    ).where(
+        (ParkingLot.available_count != available) | (ParkingLot.occupied_count != occupied)
+    )
+    fix = update(ParkingLot).values(available_count=available, occupied_count=occupied)
+    if lot_id is not None:
+        drift_query = drift_query.where(ParkingLot.id == lot_id)
+        fix = fix.where(ParkingLot.id == lot_id)
+
+    drifted = db.session.execute(drift_query).all()
+    db.session.execute(fix.execution_options(synchronize_session=False))
+    db.session.commit()
+    return drifted
+
+
+def adjust_capacity(lot_id, delta):
+    # New spots start free and only free spots are removed, so a resize
+    # only moves the available counter.
+    db.session.execute(
+        update(ParkingLot)
+        .where(ParkingLot.id == lot_id)
+        .values(
+            max_spots=ParkingLot.max_spots + delta,
+            available_count=ParkingLot.available_count + delta,
+            spot_version=ParkingLot.spot_version + 1,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def adjust_counts_many(occupied_deltas):
+    # One UPDATE for a batch touching several lots: {lot_id: occupied_delta}.
+    # spot_version moves by one per spot, as with adjust_counts, because spot
+    # map caches count each changed spot as one version.
+    if not occupied_deltas:
+        return
+    delta = case(occupied_deltas, value=ParkingLot.id, else_=0)
+    changed = case({lot_id: abs(d) for lot_id, d in occupied_deltas.items()}, value=ParkingLot.id, else_=0)
+    db.session.execute(
+        update(ParkingLot)
+        .where(ParkingLot.id.in_(list(occupied_deltas)))
+        .values(
+            occupied_count=ParkingLot.occupied_count + delta,
+            available_count=ParkingLot.available_count - delta,
+            spot_version=ParkingLot.spot_version + changed,
+        )
+        .execution_options(synchronize_session=False)
+    )
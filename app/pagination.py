@@ -0,0 +1,58 @@
+import base64
+import json
+from datetime import datetime
+from flask import Response, request, stream_with_context
+from . import db
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK_SIZE = 1000
+
+
+class PageArgumentError(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, types):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if len(values) != len(types):
+            raise ValueError
+        return [datetime.fromisoformat(v) if t is datetime else t(v) for v, t in zip(values, types)]
+    except (ValueError, TypeError):
+        raise PageArgumentError('invalid cursor')
+
+
+def page_args(cursor_types=(int,), default=DEFAULT_PAGE_SIZE):
+    limit = request.args.get('limit', default, type=int)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise PageArgumentError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+    after = request.args.get('after')
+    return limit, decode_cursor(after, cursor_types) if after else None
+
+
+def fetch_page(query, limit, cursor_key):
+    # Ask for one extra row to learn whether another page exists without a COUNT.
+    rows = db.session.execute(query.limit(limit + 1)).all()
+    next_cursor = encode_cursor(cursor_key(rows[limit - 1])) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def wants_ndjson():
+    return (request.args.get('format') == 'ndjson'
+            or request.accept_mimetypes.best == 'application/x-ndjson')
+
+
+def ndjson_response(query, serialize):
+    def generate():
+        result = db.session.execute(query.execution_options(yield_per=STREAM_CHUNK_SIZE))
+        for row in result:
+            yield json.dumps(serialize(row)) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
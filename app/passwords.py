@@ -0,0 +1,137 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from flask import current_app, has_app_context
+from sqlalchemy import update
+from werkzeug.security import check_password_hash, generate_password_hash
+from . import db
+
+DEFAULT_METHOD = 'pbkdf2'
+# The hashlib KDFs release the GIL, so a thread pool bounds hashing CPU to
+# PASSWORD_HASH_WORKERS cores while the rest of the app keeps running.
+DEFAULT_WORKERS = max(2, (os.cpu_count() or 1) // 2)
+
+
+class HashingBusy(RuntimeError):
+    """Too many password checks are already running or queued."""
+
+
+class PasswordHasher:
+    def __init__(self, app, method, workers, queue):
+        self._app = app
+        self.method = method
+        self._workers = workers
+        self._slots = threading.BoundedSemaphore(workers + queue)
+        self._executor = None
+        self._start_lock = threading.Lock()
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+        with self._start_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self._workers, thread_name_prefix='password-hash')
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def verify(self, password_hash, password):
+        """Check a password on the hashing pool; raises HashingBusy when full."""
+        return self._submit(check_password_hash, password_hash, password).result()
+
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != method_prefix(self.method)
+
+    def rehash_later(self, user_id, password_hash, password):
+        """Upgrade an outdated hash in the background after a successful login.
+
+        Best effort: skipped when the pool is busy (the next login retries),
+        and the UPDATE only applies if the hash was not changed meanwhile.
+        """
+        try:
+            self._submit(self._rehash, user_id, password_hash, password)
+        except HashingBusy:
+            pass
+
+    def _rehash(self, user_id, old_hash, password):
+        from .models import User
+
+        # Checked here, not in the request: the first check hashes once.
+        if not self.needs_rehash(old_hash):
+            return
+        new_hash = generate_password_hash(password, method=self.method)
+        with self._app.app_context():
+            try:
+                db.session.execute(
+                    update(User)
+                    .where(User.id == user_id, User.password_hash == old_hash)
+                    .values(password_hash=new_hash)
+                    .execution_options(synchronize_session=False)
+                )
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                self._app.logger.exception('Password rehash failed for user %s', user_id)
+
+
+@lru_cache(maxsize=None)
+def method_prefix(method):
+    # Normalised parameters as stored in the hash, e.g. "pbkdf2:sha256:600000".
+    return generate_password_hash('', method=method).split('$', 1)[0]
+
+
+def init_password_hashing(app):
+    app.config.setdefault('PASSWORD_HASH_METHOD', os.environ.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD))
+    app.config.setdefault('PASSWORD_HASH_WORKERS', int(os.environ.get('PASSWORD_HASH_WORKERS', DEFAULT_WORKERS)))
+    app.config.setdefault('PASSWORD_HASH_QUEUE',
+                          int(os.environ.get('PASSWORD_HASH_QUEUE', 4 * app.config['PASSWORD_HASH_WORKERS'])))
+    app.extensions['password_hasher'] = PasswordHasher(
+        app,
+        app.config['PASSWORD_HASH_METHOD'],
+        app.config['PASSWORD_HASH_WORKERS'],
+        app.config['PASSWORD_HASH_QUEUE'],
+    )
+
+
+def current_hasher():
+    return current_app.extensions['password_hasher']
+
+
+def hash_password(password):
+    method = current_app.config['PASSWORD_HASH_METHOD'] if has_app_context() else DEFAULT_METHOD
+    return generate_password_hash(password, method=method)
+
+
+def time_method(method, rounds=3):
+    """Best-of-`rounds` milliseconds to hash one password with `method`."""
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        generate_password_hash('calibration password', method=method)
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def calibrate(algorithm, target_ms):
+    """Return (method, measured_ms) for a cost near target_ms on this machine.
+
+    pbkdf2 iterations scale linearly; scrypt takes the first power-of-two
+    cost that reaches the target.
+    """
+    if algorithm == 'pbkdf2':
+        probe = 100000
+        iterations = probe * target_ms / time_method(f'pbkdf2:sha256:{probe}')
+        iterations = max(10000, int(round(iterations, -4)))
+        method = f'pbkdf2:sha256:{iterations}'
+        return method, time_method(method)
+    # scrypt cost is a power of two and also sets memory use (128 * n * r bytes).
+    n = 2 ** 12
+    while True:
+        method = f'scrypt:{n}:8:1'
+        elapsed = time_method(method)
+        if elapsed >= target_ms or n >= 2 ** 20:
+            return method, elapsed
+        n *= 2
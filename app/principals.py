@@ -0,0 +1,156 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, has_app_context
+from flask_login import UserMixin
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from . import db
+from .models import User
+
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = 60
+
+
+class UserPrincipal(UserMixin):
+    """What Flask-Login keeps as current_user on most requests.
+
+    Carries only the fields the views and templates need on every page;
+    anything else (email, reservations, ...) is read from the full User,
+    which costs a query.
+    """
+
+    def __init__(self, id, username, full_name, is_admin, password_version):
+        self.id = id
+        self.username = username
+        self.full_name = full_name
+        self.is_admin = bool(is_admin)
+        self.password_version = password_version
+
+    def get_id(self):
+        return f'{self.id}:{self.password_version}'
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(db.session.get(User, self.id), name)
+
+
+class PrincipalCache:
+    """Bounded LRU of principals by user id, each valid for `ttl` seconds."""
+
+    def __init__(self, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, principal):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[principal.id] = (time.monotonic() + self.ttl, principal)
+            self._entries.move_to_end(principal.id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                if self._entries.pop(user_id, None) is not None:
+                    self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+def init_user_cache(app):
+    app.extensions['user_cache'] = PrincipalCache(
+        app.config.get('USER_CACHE_SIZE', USER_CACHE_SIZE),
+        app.config.get('USER_CACHE_TTL', USER_CACHE_TTL),
+    )
+
+
+def current_user_cache():
+    return current_app.extensions['user_cache']
+
+
+def _fetch(user_id):
+    row = db.session.execute(
+        select(User.id, User.username, User.full_name, User.is_admin, User.password_version)
+        .where(User.id == user_id)
+    ).first()
+    if row is None:
+        return None
+    return UserPrincipal(row.id, row.username, row.full_name, row.is_admin, str(row.password_version))
+
+
+def load_principal(session_id):
+    """Resolve the id Flask-Login stored in the session ("<id>:<version>").
+
+    A session whose password version no longer matches is treated as logged
+    out. A cached principal that disagrees may just be stale (the password
+    was changed through another worker), so it is re-read once first.
+    """
+    user_id, _, version = str(session_id).partition(':')
+    try:
+        user_id = int(user_id)
+    except ValueError:
+        return None
+    cache = current_user_cache()
+    principal = cache.get(user_id)
+    if principal is None or (version and principal.password_version != version):
+        principal = _fetch(user_id)
+        if principal is None:
+            return None
+        cache.put(principal)
+    # Sessions created before versioned ids carry no version and are accepted.
+    if version and principal.password_version != version:
+        return None
+    return principal
+
+
+# Changed users are evicted once the change commits. Changes this process
+# cannot see (other workers, raw SQL) age out after the TTL.
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _record_user_change(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_users', set()).add(target.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _evict_changed_users(session):
+    changed = session.info.pop('changed_users', None)
+    if changed and has_app_context() and 'user_cache' in current_app.extensions:
+        current_user_cache().invalidate(changed)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_users(session):
+    session.info.pop('changed_users', None)
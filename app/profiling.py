@@ -0,0 +1,204 @@
+import os
+import random
+import threading
+import time
+from flask import before_render_template, current_app, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+from . import db
+from .query_budget import install_query_counter
+
+# Histogram upper bounds in seconds (Prometheus "le" buckets, +Inf implied).
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = 0
+        while index < len(BUCKETS) and value > BUCKETS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside its bucket."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = BUCKETS[index - 1] if index else 0.0
+                upper = BUCKETS[index] if index < len(BUCKETS) else BUCKETS[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return BUCKETS[-1]
+
+
+class EndpointStats:
+    __slots__ = ('wall', 'sql', 'template', 'queries', 'rows')
+
+    def __init__(self):
+        self.wall = Histogram()
+        self.sql = Histogram()
+        self.template = Histogram()
+        self.queries = 0
+        self.rows = 0
+
+
+class Profiler:
+    """Per-endpoint timings for a random sample of requests (this process only)."""
+
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, wall, sql, queries, template, rows):
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = EndpointStats()
+            stats.wall.observe(wall)
+            stats.sql.observe(sql)
+            stats.template.observe(template)
+            stats.queries += queries
+            stats.rows += rows
+
+    def summary(self):
+        with self._lock:
+            rows = []
+            for endpoint, stats in self._endpoints.items():
+                count = stats.wall.count
+                rows.append({
+                    'endpoint': endpoint,
+                    'requests': count,
+                    'p50_ms': stats.wall.quantile(0.5) * 1000,
+                    'p95_ms': stats.wall.quantile(0.95) * 1000,
+                    'p99_ms': stats.wall.quantile(0.99) * 1000,
+                    'mean_ms': stats.wall.sum / count * 1000,
+                    'sql_queries': stats.queries / count,
+                    'sql_ms': stats.sql.sum / count * 1000,
+                    'template_ms': stats.template.sum / count * 1000,
+                    'rows': stats.rows / count,
+                    'total_s': stats.wall.sum,
+                })
+        return sorted(rows, key=lambda row: row['total_s'], reverse=True)
+
+    def prometheus(self):
+        lines = []
+        histograms = (
+            ('parking_request_duration_seconds', 'wall', 'Request wall time.'),
+            ('parking_request_sql_duration_seconds', 'sql', 'Time spent executing SQL per request.'),
+            ('parking_request_template_duration_seconds', 'template', 'Time spent rendering templates per request.'),
+        )
+        counters = (
+            ('parking_request_sql_queries_total', 'queries', 'SQL statements issued.'),
+            ('parking_request_rows_loaded_total', 'rows', 'ORM objects loaded.'),
+        )
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            for name, attr, help_text in histograms:
+                lines += [f'# HELP {name} {help_text} Sampled requests only.', f'# TYPE {name} histogram']
+                for endpoint, stats in endpoints:
+                    histogram = getattr(stats, attr)
+                    cumulative = 0
+                    for bound, bucket_count in zip(BUCKETS + ('+Inf',), histogram.counts):
+                        cumulative += bucket_count
+                        lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {histogram.sum:.6f}')
+                    lines.append(f'{name}_count{{endpoint="{endpoint}"}} {histogram.count}')
+            for name, attr, help_text in counters:
+                lines += [f'# HELP {name} {help_text} Sampled requests only.', f'# TYPE {name} counter']
+                for endpoint, stats in endpoints:
+                    lines.append(f'{name}{{endpoint="{endpoint}"}} {getattr(stats, attr)}')
+        lines += ['# HELP parking_profile_sample_rate Fraction of requests profiled.',
+                  '# TYPE parking_profile_sample_rate gauge',
+                  f'parking_profile_sample_rate {self.sample_rate}']
+        return '\n'.join(lines) + '\n'
+
+
+def _profiling():
+    return has_request_context() and 'profile' in g
+
+
+def _start_request():
+    if random.random() < current_app.extensions['profiler'].sample_rate:
+        g.profile = {'started': time.perf_counter(), 'queries': g.get('query_count', 0),
+                     'sql': 0.0, 'template': 0.0, 'rows': 0, 'templates': []}
+
+
+def _finish_request(exc):
+    profile = g.pop('profile', None)
+    if profile is None:
+        return
+    current_app.extensions['profiler'].record(
+        request.endpoint or 'unmatched',
+        time.perf_counter() - profile['started'],
+        profile['sql'],
+        g.get('query_count', 0) - profile['queries'],
+        profile['template'],
+        profile['rows'],
+    )
+
+
+def _sql_started(conn, cursor, statement, parameters, context, executemany):
+    if _profiling():
+        conn.info.setdefault('profile_started', []).append(time.perf_counter())
+
+
+def _sql_finished(conn, cursor, statement, parameters, context, executemany):
+    if _profiling() and conn.info.get('profile_started'):
+        g.profile['sql'] += time.perf_counter() - conn.info['profile_started'].pop()
+
+
+def _object_loaded(target, context):
+    if _profiling():
+        g.profile['rows'] += 1
+
+
+def _template_started(sender, template, context, **extra):
+    if _profiling():
+        g.profile['templates'].append(time.perf_counter())
+
+
+def _template_finished(sender, template, context, **extra):
+    if _profiling() and g.profile['templates']:
+        g.profile['template'] += time.perf_counter() - g.profile['templates'].pop()
+
+
+def install_profiling(app, engine):
+    """Profile a sample of requests when PROFILING_ENABLED is set.
+
+    Each sampled request records wall time, SQL statement count and time,
+    template render time and ORM objects loaded, aggregated per endpoint.
+    PROFILING_SAMPLE_RATE (0-1) sets the sampled fraction; requests that
+    are not sampled pay for one random() call.
+    """
+    enabled = app.config.setdefault('PROFILING_ENABLED', os.environ.get('PROFILING_ENABLED', '') in ('1', 'true'))
+    rate = float(app.config.setdefault('PROFILING_SAMPLE_RATE', os.environ.get('PROFILING_SAMPLE_RATE', 1.0)))
+    app.config.setdefault('PROFILING_METRICS_TOKEN', os.environ.get('PROFILING_METRICS_TOKEN'))
+    if not enabled:
+        return
+    app.extensions['profiler'] = Profiler(rate)
+    install_query_counter(engine)
+    for name, listener in (('before_cursor_execute', _sql_started), ('after_cursor_execute', _sql_finished)):
+        if not event.contains(engine, name, listener):
+            event.listen(engine, name, listener)
+    if not event.contains(db.Model, 'load', _object_loaded):
+        event.listen(db.Model, 'load', _object_loaded, propagate=True)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+    app.before_request(_start_request)
+    app.teardown_request(_finish_request)
+
+
+def current_profiler():
+    return current_app.extensions.get('profiler')
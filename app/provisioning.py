@@ -0,0 +1,147 @@
+from sqlalchemy import delete, exists, insert, select
+from . import db
+from .archive import archived_spot_ids
+from .models import ParkingLot, ParkingSpot, Reservation
+from .occupancy import adjust_capacity
+from .response_cache import bump
+from .spot_events import record_lot_reshaped
+
+MAX_SPOTS_PER_LOT = 1000
+
+
+class LotValidationError(ValueError):
+    pass
+
+
+class ResizeError(ValueError):
+    pass
+
+
+def validate_lot(data, require_spots=True):
+    """Validate lot fields from a form, CSV row or JSON object."""
+    name = str(data.get('name') or '').strip()
+    address = str(data.get('address') or '').strip()
+    pin_code = str(data.get('pin_code') or '').strip()
+
+    if not (3 <= len(name) <= 100):
+        raise LotValidationError('Location name must be between 3 and 100 characters.')
+
+    if not (10 <= len(address) <= 200):
+        raise LotValidationError('Address must be between 10 and 200 characters.')
+
+    if not pin_code.isdigit() or len(pin_code) != 6:
+        raise LotValidationError('PIN Code must be exactly 6 digits.')
+
+    try:
+        price = float(data.get('price_per_hour', 0))
+        if not (0.01 <= price <= 10000):
+            raise ValueError
+    except (TypeError, ValueError):
+        raise LotValidationError('Invalid price value. Must be between ₹0.01 and ₹10,000.')
+
+    values = {
+        'prime_location_name': name,
+        'address': address,
+        'pin_code': pin_code,
+        'price_per_hour': price,
+    }
+
+    max_spots = data.get('max_spots')
+    if max_spots in (None, '') and not require_spots:
+        return values
+    try:
+        spots = int(max_spots)
+        if not (1 <= spots <= MAX_SPOTS_PER_LOT):
+            raise ValueError
+    except (TypeError, ValueError):
+        raise LotValidationError(f'Invalid number of spots. Must be between 1 and {MAX_SPOTS_PER_LOT}.')
+    values['max_spots'] = spots
+    return values
+
+
+def provision_spots(lot_ids_and_counts):
+    # One executemany for every spot of every lot, instead of an ORM object each.
+    params = [
+        {'lot_id': lot_id, 'status': 'A'}
+        for lot_id, count in lot_ids_and_counts
+        for _ in range(count)
+    ]
+    if params:
+        db.session.execute(insert(ParkingSpot), params)
+    return len(params)
+
+
+def create_lot(values):
+    lot = ParkingLot(**values, available_count=values['max_spots'], occupied_count=0)
+    db.session.add(lot)
+    db.session.flush()
+    provision_spots([(lot.id, lot.max_spots)])
+    return lot
+
+
+def resize_lot(lot, new_size):
+    """Grow by inserting free spots or shrink by deleting free spots at the tail.
+
+    Spots that are occupied or referenced by past reservations, live or
+    archived, are never removed: SQLite reuses the highest freed ids, so a
+    deleted spot's id would come back on the next grow. The caller owns the
+    transaction and should roll back on ResizeError.
+    """
+    delta = new_size - lot.max_spots
+    if delta > 0:
+        provision_spots([(lot.id, delta)])
+    elif delta < 0:
+        has_history = exists().where(Reservation.spot_id == ParkingSpot.id)
+        query = (
+            select(ParkingSpot.id)
+            .where(ParkingSpot.lot_id == lot.id, ParkingSpot.status == 'A', ~has_history)
+            .order_by(ParkingSpot.id.desc())
+            .limit(-delta)
+        )
+        archived = archived_spot_ids(lot.id)
+        if archived is not None:
+            query = query.where(ParkingSpot.id.not_in(archived))
+        removable = db.session.scalars(query).all()
+        if len(removable) < -delta:
+            raise ResizeError(
+                f'Only {len(removable)} spot(s) can be removed: occupied spots and '
+                'spots with reservation history are kept.'
+            )
+        deleted = db.session.execute(
+            delete(ParkingSpot)
+            .where(ParkingSpot.id.in_(removable), ParkingSpot.status == 'A')
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if deleted != len(removable):
+            raise ResizeError('Spots were reserved while resizing. Please try again.')
+    if delta:
+        adjust_capacity(lot.id, delta)
+        record_lot_reshaped(db.session, lot.id)
+    return delta
+
+
+def import_lots(rows):
+    """Validate and create many lots with their spots in one transaction.
+
+    Returns (lots_created, spots_created); raises LotValidationError naming
+    every invalid row before anything is written.
+    """
+    values, errors = [], []
+    for number, row in enumerate(rows, start=1):
+        try:
+            values.append(validate_lot(row))
+        except LotValidationError as e:
+            errors.append(f'row {number}: {e}')
+    if errors:
+        raise LotValidationError('; '.join(errors))
+    if not values:
+        return 0, 0
+
+    lot_ids = db.session.scalars(
+        insert(ParkingLot).returning(ParkingLot.id, sort_by_parameter_order=True),
+        [dict(v, available_count=v['max_spots'], occupied_count=0) for v in values],
+    ).all()
+    spots = provision_spots(zip(lot_ids, (v['max_spots'] for v in values)))
+    bump('lots')
+    db.session.commit()
+    return len(lot_ids), spots
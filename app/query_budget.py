@@ -0,0 +1,94 @@
+import logging
+from functools import wraps
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUDGET = 10
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+def query_budget(limit):
+    """Set the maximum number of SQL statements a view may issue per request."""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            g.query_budget = limit
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+
+def install_query_counter(engine):
+    """Count SQL statements per request in g.query_count (idempotent)."""
+    if not event.contains(engine, 'before_cursor_execute', _count_query):
+        event.listen(engine, 'before_cursor_execute', _count_query)
+
+
+def _overrun():
+    """The overrun message if this request is over its budget, else None."""
+    if not (has_request_context() and current_app.extensions.get('query_budget')):
+        return None
+    budget = g.get('query_budget', current_app.config['QUERY_BUDGET_DEFAULT'])
+    count = g.get('query_count', 0)
+    if budget is not None and count > budget:
+        return f'{request.endpoint} issued {count} queries (budget {budget})'
+    return None
+
+
+@event.listens_for(Session, 'before_commit')
+@event.listens_for(Session, 'after_flush')
+def _check_before_commit(session, *args):
+    # Enforce while the writes can still be abandoned: raising here fails
+    # the commit (after_flush covers the statements the commit itself
+    # flushes), so a request that errors out saved nothing.
+    message = _overrun()
+    if message and current_app.config['QUERY_BUDGET_ENFORCE']:
+        raise QueryBudgetExceeded(message)
+
+
+@event.listens_for(Session, 'after_commit')
+def _note_commit(session):
+    if has_request_context():
+        g.query_budget_committed = True
+
+
+def _check_budget(response):
+    message = _overrun()
+    if message is None:
+        return response
+    # Once the request has committed, failing it would report an error for
+    # writes that were saved; overruns after that point are only logged.
+    if current_app.config['QUERY_BUDGET_ENFORCE'] and not g.get('query_budget_committed'):
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+    return response
+
+
+def install_query_budget(app, engine):
+    """Count SQL statements per request and flag endpoints over budget.
+
+    Active in debug/testing or when QUERY_BUDGET_ENABLED is set. Budgets come
+    from @query_budget on the view, else QUERY_BUDGET_DEFAULT. Overruns raise
+    QueryBudgetExceeded when QUERY_BUDGET_ENFORCE is set, else are logged.
+    Enforcement happens before each commit and at the end of the request,
+    but never after the request has committed.
+    """
+    app.config.setdefault('QUERY_BUDGET_DEFAULT', DEFAULT_BUDGET)
+    app.config.setdefault('QUERY_BUDGET_ENFORCE', app.testing)
+    enabled = app.config.get('QUERY_BUDGET_ENABLED', app.debug or app.testing)
+    if not enabled:
+        return
+    app.extensions['query_budget'] = True
+    install_query_counter(engine)
+    app.after_request(_check_budget)
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+from . import db
+from .models import DailyLotUsage, ParkingLot, User
+
+
+def lot_breakdown():
+    totals = {
+        row.lot_id: row
+        for row in db.session.execute(
+            select(
+                DailyLotUsage.lot_id,
+                func.sum(DailyLotUsage.revenue).label('revenue'),
+                func.sum(DailyLotUsage.completed_stays).label('completed'),
+                func.sum(DailyLotUsage.occupied_hours).label('hours'),
+            ).group_by(DailyLotUsage.lot_id)
+        )
+    }
+    lots = db.session.execute(
+        select(ParkingLot.id, ParkingLot.prime_location_name, ParkingLot.occupied_count)
+    ).all()
+
+    breakdown = []
+    for lot_id, name, active in lots:
+        row = totals.pop(lot_id, None)
+        if row is None and not active:
+            continue
+        breakdown.append({
+            'id': lot_id,
+            'prime_location_name': name,
+            'active': active,
+            'completed': row.completed if row else 0,
+            'revenue': row.revenue if row else 0,
+            'hours': row.hours if row else 0,
+        })
+    for lot_id, row in totals.items():
+        # Lots deleted since their revenue was recorded
+        breakdown.append({'id': lot_id, 'prime_location_name': None, 'active': 0,
+                          'completed': row.completed, 'revenue': row.revenue, 'hours': row.hours})
+    breakdown.sort(key=lambda lot: lot['revenue'], reverse=True)
+    return breakdown
+
+
+def daily_revenue(days=30):
+    since = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days - 1)
+    rows = db.session.execute(
+        select(
+            DailyLotUsage.bucket_start,
+            func.sum(DailyLotUsage.completed_stays),
+            func.sum(DailyLotUsage.revenue),
+        )
+        .where(DailyLotUsage.bucket_start >= since)
+        .group_by(DailyLotUsage.bucket_start)
+        .order_by(DailyLotUsage.bucket_start)
+    ).all()
+    return [{'day': day.date().isoformat(), 'completed': n, 'revenue': round(r or 0, 2)} for day, n, r in rows]
+
+
+def summary():
+    counts = db.session.execute(
+        select(
+            select(func.count(ParkingLot.id)).scalar_subquery(),
+            select(func.coalesce(func.sum(ParkingLot.available_count + ParkingLot.occupied_count), 0)).scalar_subquery(),
+            select(func.count(User.id)).scalar_subquery(),
+        )
+    ).one()
+    lots = lot_breakdown()
+    completed = sum(lot['completed'] for lot in lots)
+    hours = sum(lot['hours'] for lot in lots)
+    return {
+        'total_lots': counts[0],
+        'total_spots': counts[1],
+        'total_users': counts[2],
+        'active_reservations': sum(lot['active'] for lot in lots),
+        'completed_reservations': completed,
+        'total_revenue': round(sum(lot['revenue'] for lot in lots), 2),
+        'average_stay_hours': round(hours / completed, 2) if completed else 0,
+        'lots': lots,
+    }
@@ -0,0 +1,219 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, g, make_response, request, session
+from flask_login import current_user
+from sqlalchemy import func, select
+from . import db
+from .database import dialect_insert
+from .models import CacheVersion, ParkingLot, Reservation
+
+RESPONSE_CACHE_SIZE = 256
+RESPONSE_CACHE_TTL = 300
+
+
+def _counter(name):
+    return select(CacheVersion.version).where(CacheVersion.name == name).scalar_subquery()
+
+
+def _version_sources():
+    # 'lots' and 'users' are bumped explicitly by the views that change them.
+    # Occupancy and reservations are derived from rows every booking already
+    # writes (each lot's spot_version, the newest reservation id), so reserve
+    # and release invalidate without contending on a shared counter row.
+    return {
+        'lots': _counter('lots'),
+        'users': _counter('users'),
+        'occupancy': select(func.sum(ParkingLot.spot_version)).scalar_subquery(),
+        # app.archive bumps 'reservations' when it moves old rows out.
+        'reservations': select(func.coalesce(func.max(Reservation.id), 0)).scalar_subquery()
+        + func.coalesce(_counter('reservations'), 0),
+    }
+
+
+def versions():
+    """Every cache version counter, read in one query and kept for the request."""
+    if 'cache_versions' not in g:
+        row = db.session.execute(select(*(
+            func.coalesce(source, 0).label(name) for name, source in _version_sources().items()
+        ))).one()
+        g.cache_versions = row._asdict()
+    return g.cache_versions
+
+
+def bump(*names):
+    """Invalidate everything cached under these counters once the caller commits."""
+    dialect = db.engine.dialect.name
+    for name in names:
+        if dialect in ('sqlite', 'postgresql'):
+            stmt = dialect_insert(dialect)(CacheVersion).values(name=name, version=1)
+            db.session.execute(stmt.on_conflict_do_update(
+                index_elements=['name'], set_={'version': CacheVersion.version + 1}
+            ))
+            continue
+        row = db.session.get(CacheVersion, name)
+        if row is None:
+            db.session.add(CacheVersion(name=name, version=1))
+        else:
+            row.version += 1
+    g.pop('cache_versions', None)
+
+
+class LocalCache:
+    """In-process LRU of cached strings."""
+
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCache:
+    """Shared cache for several worker processes; needs the optional redis package."""
+
+    def __init__(self, url, ttl=RESPONSE_CACHE_TTL):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('RESPONSE_CACHE_URL needs the redis package (pip install redis).')
+        self._client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self._client.get(key)
+        return None if value is None else value.decode()
+
+    def set(self, key, value):
+        # Superseded versions are never read again and simply expire.
+        self._client.set(key, value.encode(), ex=self.ttl)
+
+
+class ResponseCache:
+    def __init__(self, backend, stamp):
+        self.backend = backend
+        self.stamp = stamp
+        self._lock = threading.Lock()
+        self._counts = {}
+        self.not_modified = 0
+
+    def _count(self, name, hit):
+        with self._lock:
+            counts = self._counts.setdefault(name, [0, 0])
+            counts[0 if hit else 1] += 1
+
+    def count_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def key(self, name, depends, *extra):
+        current = versions()
+        parts = [self.stamp, name, *(f'{dep}{current[dep]}' for dep in depends), *map(str, extra)]
+        return ':'.join(parts)
+
+    def fragment(self, name, depends, render, *extra):
+        """Return render() for the current versions of `depends`, cached."""
+        key = self.key(name, depends, *extra)
+        try:
+            value = self.backend.get(key)
+        except Exception:
+            current_app.logger.exception('Response cache read failed')
+            value = None
+        self._count(name, value is not None)
+        if value is None:
+            value = render()
+            try:
+                self.backend.set(key, value)
+            except Exception:
+                current_app.logger.exception('Response cache write failed')
+        return value
+
+    def stats(self):
+        with self._lock:
+            fragments = {
+                name: {'hits': hits, 'misses': misses,
+                       'hit_ratio': round(hits / (hits + misses), 4)}
+                for name, (hits, misses) in self._counts.items()
+            }
+            hits = sum(c[0] for c in self._counts.values())
+            lookups = hits + sum(c[1] for c in self._counts.values())
+        return {
+            'backend': type(self.backend).__name__,
+            'entries': len(self.backend) if isinstance(self.backend, LocalCache) else None,
+            'hits': hits,
+            'misses': lookups - hits,
+            'hit_ratio': round(hits / lookups, 4) if lookups else None,
+            'not_modified': self.not_modified,
+            'fragments': fragments,
+        }
+
+
+def _template_stamp(app):
+    # Cached HTML and ETags must not outlive a deploy that changed templates.
+    newest = 0
+    for root, _, files in os.walk(os.path.join(app.root_path, app.template_folder)):
+        for filename in files:
+            newest = max(newest, os.path.getmtime(os.path.join(root, filename)))
+    return format(int(newest), 'x')
+
+
+def init_response_cache(app):
+    url = app.config.setdefault('RESPONSE_CACHE_URL', os.environ.get('RESPONSE_CACHE_URL'))
+    if url:
+        backend = RedisCache(url, int(app.config.get('RESPONSE_CACHE_TTL', RESPONSE_CACHE_TTL)))
+    else:
+        backend = LocalCache(int(app.config.get('RESPONSE_CACHE_SIZE', RESPONSE_CACHE_SIZE)))
+    app.extensions['response_cache'] = ResponseCache(backend, _template_stamp(app))
+
+
+def current_response_cache():
+    return current_app.extensions['response_cache']
+
+
+def conditional(*depends, per_user=True):
+    """Answer GETs with an ETag built from the version counters, and 304s.
+
+    The ETag is known before the view runs, so a matching If-None-Match
+    costs one version query. Responses carrying flashed messages are never
+    treated as cacheable.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method != 'GET' or session.get('_flashes'):
+                return f(*args, **kwargs)
+            cache = current_response_cache()
+            extra = [request.full_path]
+            if per_user:
+                extra.append(current_user.get_id())
+            etag = hashlib.sha1(cache.key(request.endpoint, depends, *extra).encode()).hexdigest()
+            if etag in request.if_none_match:
+                cache.count_not_modified()
+                response = make_response('', 304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return decorated_function
+    return decorator
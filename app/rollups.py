@@ -0,0 +1,236 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, insert, select, union_all
+from . import db
+from .database import dialect_insert
+from .models import DailyLotUsage, HourlyLotUsage, ParkingLot, ParkingSpot, Reservation, stay_cost
+
+GRANULARITIES = {'hourly': HourlyLotUsage, 'daily': DailyLotUsage}
+METRICS = ('revenue', 'completed_stays', 'occupied_hours')
+
+
+def hour_bucket(ts):
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def day_bucket(ts):
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+BUCKETS = (
+    (HourlyLotUsage, hour_bucket, timedelta(hours=1)),
+    (DailyLotUsage, day_bucket, timedelta(days=1)),
+)
+
+
+def split_hours(start, end, floor, step):
+    bucket = floor(start)
+    while bucket < end:
+        following = bucket + step
+        hours = (min(end, following) - max(start, bucket)).total_seconds() / 3600
+        if hours > 0:
+            yield bucket, hours
+        bucket = following
+
+
+def _greatest(a, b):
+    return func.max(a, b) if db.engine.dialect.name == 'sqlite' else func.greatest(a, b)
+
+
+def _occupied_now(lot_id, offset=0):
+    return (
+        select(ParkingLot.occupied_count + offset)
+        .where(ParkingLot.id == lot_id)
+        .scalar_subquery()
+    )
+
+
+def _add(model, lot_id, bucket, revenue=0, completed_stays=0, occupied_hours=0, peak=None):
+    values = dict(lot_id=lot_id, bucket_start=bucket, revenue=revenue,
+                  completed_stays=completed_stays, occupied_hours=occupied_hours,
+                  peak_occupancy=0 if peak is None else peak)
+    dialect = db.engine.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        stmt = dialect_insert(dialect)(model).values(**values)
+        updates = {name: getattr(model, name) + getattr(stmt.excluded, name) for name in METRICS}
+        if peak is not None:
+            updates['peak_occupancy'] = _greatest(model.peak_occupancy, stmt.excluded.peak_occupancy)
+        db.session.execute(stmt.on_conflict_do_update(index_elements=['lot_id', 'bucket_start'], set_=updates))
+        return
+
+    row = db.session.get(model, (lot_id, bucket))
+    if row is None:
+        row = model(lot_id=lot_id, bucket_start=bucket, revenue=0, completed_stays=0,
+                    occupied_hours=0, peak_occupancy=0)
+        db.session.add(row)
+    row.revenue += revenue
+    row.completed_stays += completed_stays
+    row.occupied_hours += occupied_hours
+    if peak is not None:
+        row.peak_occupancy = max(row.peak_occupancy, db.session.scalar(select(peak)) or 0)
+
+
+def _add_many(model, rows):
+    # rows maps (lot_id, bucket) to _add keyword arguments. Keys are unique,
+    # so SQLite and PostgreSQL take the whole batch as one multi-row upsert.
+    dialect = db.engine.dialect.name
+    if dialect not in ('sqlite', 'postgresql'):
+        for (lot_id, bucket), values in rows.items():
+            _add(model, lot_id, bucket, **values)
+        return
+    if not rows:
+        return
+    stmt = dialect_insert(dialect)(model).values([
+        dict(lot_id=lot_id, bucket_start=bucket,
+             revenue=values.get('revenue', 0),
+             completed_stays=values.get('completed_stays', 0),
+             occupied_hours=values.get('occupied_hours', 0),
+             peak_occupancy=0 if values.get('peak') is None else values['peak'])
+        for (lot_id, bucket), values in rows.items()
+    ])
+    updates = {name: getattr(model, name) + getattr(stmt.excluded, name) for name in METRICS}
+    # A 0 peak leaves the stored one alone, so rows without a peak can share the statement.
+    updates['peak_occupancy'] = _greatest(model.peak_occupancy, stmt.excluded.peak_occupancy)
+    db.session.execute(stmt.on_conflict_do_update(index_elements=['lot_id', 'bucket_start'], set_=updates))
+
+
+def record_reservation(lot_id, parking_time):
+    # Call after the spot was claimed: the lot counter already includes it.
+    for model, floor, _ in BUCKETS:
+        _add(model, lot_id, floor(parking_time), peak=_occupied_now(lot_id))
+
+
+def record_release(lot_id, parking_time, leaving_time, cost):
+    # Call after the spot was freed; the peak is the occupancy just before.
+    for model, floor, step in BUCKETS:
+        closing = floor(leaving_time)
+        hours = dict(split_hours(parking_time, leaving_time, floor, step))
+        _add(model, lot_id, closing, revenue=cost, completed_stays=1,
+             occupied_hours=hours.pop(closing, 0), peak=_occupied_now(lot_id, 1))
+        for bucket, spent in hours.items():
+            _add(model, lot_id, bucket, occupied_hours=spent)
+
+
+def record_reservations(lot_ids, parking_time):
+    # Batch form of record_reservation: one statement per granularity.
+    for model, floor, _ in BUCKETS:
+        _add_many(model, {(lot_id, floor(parking_time)): {'peak': _occupied_now(lot_id)} for lot_id in lot_ids})
+
+
+def record_releases(stays):
+    """Batch form of record_release for (lot_id, parking_time, leaving_time, cost).
+
+    Call after the spots were freed. The peak recorded for a lot is its
+    occupancy just before the whole batch was released.
+    """
+    stays = list(stays)
+    released = defaultdict(int)
+    for lot_id, *_ in stays:
+        released[lot_id] += 1
+    for model, floor, step in BUCKETS:
+        rows = defaultdict(lambda: {'revenue': 0, 'completed_stays': 0, 'occupied_hours': 0, 'peak': None})
+        for lot_id, parking_time, leaving_time, cost in stays:
+            closing = rows[lot_id, floor(leaving_time)]
+            closing['revenue'] += cost
+            closing['completed_stays'] += 1
+            closing['peak'] = _occupied_now(lot_id, released[lot_id])
+            for bucket, spent in split_hours(parking_time, leaving_time, floor, step):
+                rows[lot_id, bucket]['occupied_hours'] += spent
+        _add_many(model, rows)
+
+
+def _new_bucket():
+    return {'revenue': 0.0, 'completed_stays': 0, 'occupied_hours': 0.0, 'peak_occupancy': 0}
+
+
+def _replay(stays):
+    # Replays one lot's reserve/release events in time order, mirroring what
+    # record_reservation and record_release would have written live.
+    buckets = [defaultdict(_new_bucket) for _ in BUCKETS]
+    events = []
+    for parking_time, leaving_time, cost_per_hour in stays:
+        events.append((parking_time, 1, None))
+        if leaving_time:
+            events.append((leaving_time, -1, (parking_time, stay_cost(parking_time, leaving_time, cost_per_hour))))
+    events.sort(key=lambda event: (event[0], event[1]))
+
+    occupied = 0
+    for at, delta, stay in events:
+        if delta > 0:
+            occupied += 1
+        for (_, floor, step), rows in zip(BUCKETS, buckets):
+            row = rows[floor(at)]
+            row['peak_occupancy'] = max(row['peak_occupancy'], occupied)
+            if stay:
+                parking_time, cost = stay
+                row['revenue'] += cost
+                row['completed_stays'] += 1
+                for bucket, spent in split_hours(parking_time, at, floor, step):
+                    rows[bucket]['occupied_hours'] += spent
+        if delta < 0:
+            occupied -= 1
+    return buckets
+
+
+def rebuild_rollups(lot_id=None):
+    for model in GRANULARITIES.values():
+        stmt = delete(model)
+        if lot_id is not None:
+            stmt = stmt.where(model.lot_id == lot_id)
+        db.session.execute(stmt)
+
+    from .archive import archived_stays
+
+    live = (
+        select(ParkingSpot.lot_id, Reservation.parking_time, Reservation.leaving_time, Reservation.cost_per_hour)
+        .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id)
+    )
+    if lot_id is not None:
+        live = live.where(ParkingSpot.lot_id == lot_id)
+    archived = archived_stays(lot_id)
+    stays = (union_all(live, *archived) if archived else live).subquery()
+    query = select(stays).order_by(stays.c.lot_id).execution_options(yield_per=5000)
+
+    written = 0
+
+    def flush(current_lot, stays):
+        nonlocal written
+        for (model, _, _), rows in zip(BUCKETS, _replay(stays)):
+            if rows:
+                db.session.execute(insert(model), [
+                    dict(lot_id=current_lot, bucket_start=bucket, **values)
+                    for bucket, values in rows.items()
+                ])
+                written += len(rows)
+
+    current_lot, stays = None, []
+    for row_lot, parking_time, leaving_time, cost_per_hour in db.session.execute(query):
+        if row_lot != current_lot and stays:
+            flush(current_lot, stays)
+            stays = []
+        current_lot = row_lot
+        stays.append((parking_time, leaving_time, cost_per_hour))
+    if stays:
+        flush(current_lot, stays)
+
+    db.session.commit()
+    return written
+
+
+def usage_series(granularity='daily', days=30, lot_id=None):
+    model = GRANULARITIES[granularity]
+    since = day_bucket(datetime.utcnow()) - timedelta(days=days - 1)
+    query = select(model).where(model.bucket_start >= since).order_by(model.lot_id, model.bucket_start)
+    if lot_id is not None:
+        query = query.where(model.lot_id == lot_id)
+    return [
+        {
+            'lot_id': row.lot_id,
+            'bucket_start': row.bucket_start.isoformat(),
+            'revenue': round(row.revenue, 2),
+            'completed_stays': row.completed_stays,
+            'occupied_hours': round(row.occupied_hours, 2),
+            'peak_occupancy': row.peak_occupancy,
+        }
+        for row in db.session.scalars(query)
+    ]
@@ -1,12 +1,32 @@
-from flask import Blueprint, render_template, redirect, url_for, flash
-from flask_login import login_required, current_user
+from flask import (Blueprint, Response, abort, current_app, render_template, redirect, url_for, flash, make_response,
+                   send_from_directory)
+import hmac
+import json
+from flask_login import login_required, login_user, current_user
 from functools import wraps
 from flask import request, jsonify
-from .models import ParkingLot, ParkingSpot, User, db
+from .models import Job, ParkingLot, ParkingSpot, User, db
 from datetime import datetime
-from .models import Reservation
+from .models import Reservation, stay_cost
 from .decorators import admin_required, user_required
+from .query_budget import query_budget
+from .spotmap import current_spot_maps
+from .live import current_hub
+from .principals import current_user_cache
+from .response_cache import bump, conditional, current_response_cache
+from .profiling import current_profiler
+from .jobs import FINISHED, JobError, current_jobs, job_json
+from .allocator import MAX_CLAIM_ATTEMPTS, claim_spot, free_spot
+from . import archive, billing, fleet, ledger, provisioning, reports, rollups
+from .provisioning import LotValidationError, ResizeError, resize_lot, validate_lot
+from .search import search_lots, search_spots, search_users
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import joinedload
+from .pagination import PageArgumentError, fetch_page, ndjson_response, page_args, wants_ndjson
 from flask import jsonify
+
+LIVE_HEARTBEAT_SECONDS = 15
+
 main = Blueprint('main', __name__)
 user = Blueprint('user', __name__, url_prefix='/user')
 admin = Blueprint('admin', __name__, url_prefix='/admin')
@@ -21,10 +41,12 @@ def index():
     return render_template('index.html')
 
 @user.route('/dashboard')
+@query_budget(2)
 @login_required
 @user_required
 def user_dashboard():
-    return render_template('user/dashboard.html')
+    reservation_count = archive.reservation_count(current_user.id)
+    return render_template('user/dashboard.html', reservation_count=reservation_count)
 
 @admin.route('/dashboard')
 @admin_required
@@ -33,62 +55,28 @@ def admin_dashboard():
 
 
 @admin.route('/lots')
+@query_budget(3)
 @admin_required
+@conditional('lots', 'occupancy')
 def manage_lots():
-    lots = ParkingLot.query.all()
-    return render_template('admin/lots.html', lots=lots)
+    lot_rows = current_response_cache().fragment(
+        'admin_lot_rows', ('lots', 'occupancy'),
+        lambda: render_template('admin/lot_rows.html', lots=ParkingLot.query.all()),
+    )
+    return render_template('admin/lots.html', lot_rows=lot_rows)
 
 @admin.route('/lots/create', methods=['GET', 'POST'])
 @admin_required
 def create_lot():
     if request.method == 'POST':
-        name = request.form.get('name', '').strip()
-        address = request.form.get('address', '').strip()
-        pin_code = request.form.get('pin_code', '')
-        price_per_hour = request.form.get('price_per_hour', 0)
-        max_spots = request.form.get('max_spots', 0)
-
-        if not (3 <= len(name) <= 100):
-            flash('Location name must be between 3 and 100 characters.', 'error')
-            return render_template('admin/lot_form.html')
-
-        if not (10 <= len(address) <= 200):
-            flash('Address must be between 10 and 200 characters.', 'error')
-            return render_template('admin/lot_form.html')
-
-        if not pin_code.isdigit() or len(pin_code) != 6:
-            flash('PIN Code must be exactly 6 digits.', 'error')
-            return render_template('admin/lot_form.html')
-
-        try:
-            price = float(price_per_hour)
-            if not (0.01 <= price <= 10000):
-                raise ValueError
-        except ValueError:
-            flash('Invalid price value. Must be between ₹0.01 and ₹10,000.', 'error')
-            return render_template('admin/lot_form.html')
-
         try:
-            spots = int(max_spots)
-            if not (1 <= spots <= 1000):
-                raise ValueError
-        except ValueError:
-            flash('Invalid number of spots. Must be between 1 and 1000.', 'error')
+            values = validate_lot(request.form)
+        except LotValidationError as e:
+            flash(str(e), 'error')
             return render_template('admin/lot_form.html')
 
-        lot = ParkingLot(
-            prime_location_name=name,
-            address=address,
-            pin_code=pin_code,
-            price_per_hour=price,
-            max_spots=spots
-        )
-        db.session.add(lot)
-        
-        for _ in range(lot.max_spots):
-            spot = ParkingSpot(lot=lot)
-            db.session.add(spot)
-            
+        provisioning.create_lot(values)
+        bump('lots')
         db.session.commit()
         flash('Parking lot created successfully!', 'success')
         return redirect(url_for('admin.manage_lots'))
@@ -99,35 +87,22 @@ def create_lot():
 def edit_lot(lot_id):
     lot = ParkingLot.query.get_or_404(lot_id)
     if request.method == 'POST':
-        name = request.form.get('name', '').strip()
-        address = request.form.get('address', '').strip()
-        pin_code = request.form.get('pin_code', '')
-        price_per_hour = request.form.get('price_per_hour', 0)
-
-        if not (3 <= len(name) <= 100):
-            flash('Location name must be between 3 and 100 characters.', 'error')
-            return render_template('admin/lot_form.html', lot=lot)
-
-        if not (10 <= len(address) <= 200):
-            flash('Address must be between 10 and 200 characters.', 'error')
-            return render_template('admin/lot_form.html', lot=lot)
-
-        if not pin_code.isdigit() or len(pin_code) != 6:
-            flash('PIN Code must be exactly 6 digits.', 'error')
+        try:
+            values = validate_lot(request.form, require_spots=False)
+        except LotValidationError as e:
+            flash(str(e), 'error')
             return render_template('admin/lot_form.html', lot=lot)
 
+        new_size = values.pop('max_spots', lot.max_spots)
+        for field, value in values.items():
+            setattr(lot, field, value)
         try:
-            price = float(price_per_hour)
-            if not (0.01 <= price <= 10000):
-                raise ValueError
-        except ValueError:
-            flash('Invalid price value. Must be between ₹0.01 and ₹10,000.', 'error')
+            resize_lot(lot, new_size)
+        except ResizeError as e:
+            db.session.rollback()
+            flash(str(e), 'error')
             return render_template('admin/lot_form.html', lot=lot)
-
-        lot.prime_location_name = name
-        lot.address = address
-        lot.pin_code = pin_code
-        lot.price_per_hour = price
+        bump('lots')
         db.session.commit()
         flash('Parking lot updated successfully!', 'success')
         return redirect(url_for('admin.manage_lots'))
@@ -136,68 +111,100 @@ def edit_lot(lot_id):
 @admin.route('/lots/<int:lot_id>/delete', methods=['POST'])
 @admin_required
 def delete_lot(lot_id):
-    lot = ParkingLot.query.get_or_404(lot_id)
-    occupied_spots = any(spot.status == 'O' for spot in lot.spots)
-    if occupied_spots:
-        flash('Cannot delete lot with occupied spots.', 'error')
+    # Deleting a lot with thousands of spots and their history takes a
+    # while, so it runs as a background job (see app.jobs).
+    try:
+        job = current_jobs().submit('delete_lot', {'lot_id': lot_id}, current_user.id)
+    except JobError as e:
+        flash(str(e), 'error')
         return redirect(url_for('admin.manage_lots'))
-    db.session.delete(lot)
-    db.session.commit()
-    flash('Parking lot deleted successfully!', 'success')
-    return redirect(url_for('admin.manage_lots'))
+    flash(f'Deleting parking lot in the background (job #{job.id}).', 'info')
+    return redirect(url_for('admin.view_jobs'))
 
 @admin.route('/users')
+@query_budget(3)
 @admin_required
+@conditional('users', 'reservations', 'lots')
 def manage_users():
-    users = User.query.all()
-    return render_template('admin/users.html', users=users)
+    def render_rows():
+        reservation_count = (
+            select(func.count(Reservation.id))
+            .where(Reservation.user_id == User.id)
+            .scalar_subquery()
+        ) + archive.archived_count(User.id)
+        users = db.session.execute(select(User, reservation_count)).all()
+        return render_template('admin/user_rows.html', users=users)
+
+    # Deleting a lot deletes its reservations, hence the 'lots' dependency.
+    user_rows = current_response_cache().fragment(
+        'admin_user_rows', ('users', 'reservations', 'lots'), render_rows
+    )
+    return render_template('admin/users.html', user_rows=user_rows)
 
 @admin.route('/lots/<int:lot_id>/details')
+@query_budget(4)
 @admin_required
 def lot_details(lot_id):
     lot = ParkingLot.query.get_or_404(lot_id)
-    return render_template('admin/lot_details.html', lot=lot)
+    occupied_since = dict(db.session.execute(
+        select(Reservation.spot_id, Reservation.parking_time)
+        .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id)
+        .where(ParkingSpot.lot_id == lot.id, Reservation.leaving_time.is_(None))
+    ).all())
+    return render_template('admin/lot_details.html', lot=lot, spot_map=current_spot_maps().get(lot), occupied_since=occupied_since)
 
 @admin.route('/users/<int:user_id>/details')
+@query_budget(3)
 @admin_required
 def view_user_details(user_id):
     user = User.query.get_or_404(user_id)
-    return render_template('admin/user_details.html', user=user)
+    reservation_count = archive.reservation_count(user.id)
+    return render_template('admin/user_details.html', user=user, reservation_count=reservation_count)
 
 
 @user.route('/parking-lots')
+@query_budget(3)
 @login_required
 @user_required
+@conditional('lots', 'occupancy')
 def view_parking_lots():
-    lots = ParkingLot.query.all()
-    return render_template('user/parking_lots.html', lots=lots)
+    lot_cards = current_response_cache().fragment(
+        'user_lot_cards', ('lots', 'occupancy'),
+        lambda: render_template('user/lot_cards.html', lots=ParkingLot.query.all()),
+    )
+    return render_template('user/parking_lots.html', lot_cards=lot_cards)
 
 @user.route('/reserve/<int:lot_id>', methods=['POST'])
+# Two statements per claim attempt; under contention claim_spot retries.
+@query_budget(6 + 2 * MAX_CLAIM_ATTEMPTS)
 @login_required
 @user_required
 def reserve_spot(lot_id):
     lot = ParkingLot.query.get_or_404(lot_id)
-    available_spot = next((spot for spot in lot.spots if spot.status == 'A'), None)
+    spot_id = claim_spot(lot.id)
     
-    if not available_spot:
+    if spot_id is None:
+        db.session.rollback()
         flash('No spots available in this lot.', 'error')
         return redirect(url_for('user.view_parking_lots'))
     
     reservation = Reservation(
         user_id=current_user.id,
-        spot_id=available_spot.id,  
+        spot_id=spot_id,  
+        lot_id=lot.id,
         parking_time=datetime.utcnow(),
         cost_per_hour=lot.price_per_hour
     )
-    available_spot.status = 'O' 
     
     db.session.add(reservation)
+    rollups.record_reservation(lot.id, reservation.parking_time)
     db.session.commit()
     
-    flash('Spot reserved successfully!', 'success')
+    flash(f'Spot #{spot_id} reserved successfully!', 'success')
     return redirect(url_for('user.view_reservations'))
 
 @user.route('/release/<int:reservation_id>', methods=['POST'])
+@query_budget(9)
 @login_required
 @user_required
 def release_spot(reservation_id):
@@ -206,63 +213,128 @@ def release_spot(reservation_id):
     if reservation.user_id != current_user.id:
         flash('Unauthorized action.', 'error')
         return redirect(url_for('user.view_reservations'))
+
+    if reservation.leaving_time:
+        flash('This reservation has already been released.', 'error')
+        return redirect(url_for('user.view_reservations'))
     
-    reservation.leaving_time = datetime.utcnow()
-    reservation.spot.status = 'A' 
+    leaving_time = datetime.utcnow()
+    released = db.session.execute(
+        update(Reservation)
+        .where(Reservation.id == reservation.id, Reservation.leaving_time.is_(None))
+        .values(leaving_time=leaving_time)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not released:
+        db.session.rollback()
+        flash('This reservation has already been released.', 'error')
+        return redirect(url_for('user.view_reservations'))
+
+    lot_id = reservation.spot.lot_id
+    free_spot(reservation.spot_id, lot_id)
+    rollups.record_release(lot_id, reservation.parking_time, leaving_time,
+                           stay_cost(reservation.parking_time, leaving_time, reservation.cost_per_hour))
     db.session.commit()
     
     flash(f'Parking spot released. Total cost: ${reservation.calculate_total_cost()}', 'success')
     return redirect(url_for('user.view_reservations'))
 
+@user.route('/api/reservations/batch', methods=['POST'])
+@query_budget(12)
+@login_required
+@user_required
+def reserve_batch():
+    data = request.get_json(silent=True) or {}
+    try:
+        lot_ids, count, mode = fleet.parse_reserve(data)
+        reserved, shortfall = fleet.reserve_batch(current_user.id, lot_ids, count, mode)
+    except fleet.BatchError as e:
+        return jsonify({'error': str(e)}), 400
+
+    body = {'mode': mode, 'requested': count, 'reserved': reserved, 'shortfall': shortfall}
+    if not reserved:
+        body['error'] = 'Not enough free spots in the requested lots.'
+        return jsonify(body), 409
+    return jsonify(body), 201
+
+@user.route('/api/reservations/batch-release', methods=['POST'])
+@query_budget(8)
+@login_required
+@user_required
+def release_batch():
+    data = request.get_json(silent=True) or {}
+    try:
+        reservation_ids, mode = fleet.parse_release(data)
+    except fleet.BatchError as e:
+        return jsonify({'error': str(e)}), 400
+
+    released, failed = fleet.release_batch(current_user.id, reservation_ids, mode)
+    body = {
+        'mode': mode,
+        'released': released,
+        'failed': failed,
+        'total_cost': round(sum(item['cost'] for item in released), 2),
+    }
+    return jsonify(body), 200 if released else 409
+
 @user.route('/reservations')
+@query_budget(2)
 @login_required
 @user_required
 def view_reservations():
-    return render_template('user/reservations.html',reservations=current_user.reservations, now=datetime.utcnow)
+    active_reservations = Reservation.query.options(
+        joinedload(Reservation.spot).joinedload(ParkingSpot.lot)
+    ).filter(
+        Reservation.user_id == current_user.id,
+        Reservation.leaving_time.is_(None)
+    ).order_by(Reservation.parking_time.desc()).all()
+    return render_template('user/reservations.html',reservations=active_reservations, now=datetime.utcnow)
 
 @user.route('/history')
+@query_budget(3)
 @login_required
 @user_required
 def parking_history():
-    completed_reservations = Reservation.query.filter_by(
-        user_id=current_user.id
-    ).filter(
-        Reservation.leaving_time.isnot(None)
-    ).order_by(Reservation.parking_time.desc()).all()
-    return render_template('user/history.html', reservations=completed_reservations)
+    since = request.args.get('since', type=datetime.fromisoformat)
+    until = request.args.get('until', type=datetime.fromisoformat)
+    stays = archive.history(current_user.id, since, until, completed=True)
+    reservations = db.session.execute(select(stays).order_by(stays.c.parking_time.desc())).all()
+    return render_template('user/history.html', reservations=reservations, stay_cost=stay_cost,
+                           since=since, until=until)
 
 
 @admin.route('/reservations')
+# User loader, username, archive months, page, count, lot list.
+@query_budget(6)
 @admin_required
 def view_all_reservations():
-    from datetime import datetime
-    reservations = Reservation.query.order_by(Reservation.parking_time.desc()).all()
-    now = datetime.utcnow()
-    return render_template('admin/reservations.html', reservations=reservations, now=now)
+    try:
+        limit, after = page_args((datetime, int), default=ledger.PAGE_SIZE)
+    except PageArgumentError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('admin.view_all_reservations'))
+    filters = ledger.parse_filters(request.args)
+    reservations, next_cursor = ledger.ledger_page(filters, limit, after)
+    count, capped = ledger.estimate_count(filters)
+    lots = db.session.execute(
+        select(ParkingLot.id, ParkingLot.prime_location_name).order_by(ParkingLot.prime_location_name)
+    ).all()
+    args = {name: value for name, value in request.args.items() if name != 'after' and value}
+    return render_template('admin/reservations.html', reservations=reservations, now=datetime.utcnow(),
+                           stay_cost=stay_cost, lots=lots, args=args, count=count, capped=capped,
+                           next_cursor=next_cursor, paged=after is not None)
 
 @admin.route('/reports')
+@query_budget(5)
 @admin_required
 def view_reports():
-    total_lots = ParkingLot.query.count()
-    total_spots = ParkingSpot.query.count()
-    total_users = User.query.count()
-    active_reservations = Reservation.query.filter(Reservation.leaving_time.is_(None)).count()
-    completed_reservations = Reservation.query.filter(Reservation.leaving_time.isnot(None)).count()
-    
-
-    completed_bookings = Reservation.query.filter(Reservation.leaving_time.isnot(None)).all()
-    total_revenue = sum(booking.calculate_total_cost() for booking in completed_bookings)
-    
     return render_template('admin/reports.html',
-                           total_lots=total_lots,
-                           total_spots=total_spots,
-                           total_users=total_users,
-                           active_reservations=active_reservations,
-                           completed_reservations=completed_reservations,
-                           total_revenue=total_revenue)
+                           daily=reports.daily_revenue(),
+                           **reports.summary())
 
 
 @admin.route('/search')
+@query_budget(3)
 @admin_required
 def search():
     query = request.args.get('query', '')
@@ -271,94 +343,333 @@ def search():
     if not query:
         return redirect(url_for('admin.admin_dashboard'))
     
-    results = []
+    page = max(request.args.get('page', 1, type=int), 1)
+    results, has_next = [], False
+    active_users = {}
     if search_type == 'user':
-        results = User.query.filter(
-            User.username.ilike(f'%{query}%') |
-            User.full_name.ilike(f'%{query}%')
-        ).all()
+        results, has_next = search_users(query, page)
     elif search_type == 'spot':
-        results = ParkingSpot.query.filter(
-            ParkingSpot.id.ilike(f'%{query}%')
-        ).all()
+        results = search_spots(query)
+        occupied = [spot.id for spot in results if spot.status == 'O']
+        if occupied:
+            active_users = dict(db.session.execute(
+                select(Reservation.spot_id, User.username)
+                .join(User, Reservation.user_id == User.id)
+                .where(Reservation.spot_id.in_(occupied), Reservation.leaving_time.is_(None))
+            ).all())
     elif search_type == 'location':
-        results = ParkingLot.query.filter(
-            ParkingLot.prime_location_name.ilike(f'%{query}%') |
-            ParkingLot.address.ilike(f'%{query}%')
-        ).all()
+        results, has_next = search_lots(query, page)
     
     return render_template('admin/search_results.html',
                            results=results, 
+                           active_users=active_users,
                            search_type=search_type,
-                           query=query)
+                           query=query,
+                           page=page,
+                           has_next=has_next)
+
+
+@admin.route('/api/reports/usage', methods=['GET'])
+@admin_required
+def get_usage_report():
+    granularity = request.args.get('granularity', 'daily')
+    if granularity not in rollups.GRANULARITIES:
+        return jsonify({'error': 'granularity must be hourly or daily'}), 400
+    days = min(request.args.get('days', 30, type=int), 31 if granularity == 'hourly' else 366)
+    lot_id = request.args.get('lot_id', type=int)
+    return jsonify({
+        'granularity': granularity,
+        'days': days,
+        'buckets': rollups.usage_series(granularity, max(days, 1), lot_id),
+    })
+
+
+@admin.route('/api/invoices', methods=['GET'])
+@admin_required
+def get_invoices():
+    try:
+        by = billing.parse_by(request.args.get('by', 'user'))
+        month, items = billing.invoices(request.args.get('month'), by)
+    except billing.BillingError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'month': month,
+        'by': by,
+        'invoices': items,
+        'amount_paise': sum(item['amount_paise'] for item in items),
+    })
+
+
+@admin.route('/api/invoices/<by>/<int:key>', methods=['GET'])
+@query_budget(4)
+@admin_required
+def get_invoice(by, key):
+    try:
+        return jsonify(billing.invoice(request.args.get('month'), billing.parse_by(by), key))
+    except billing.BillingError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@main.route('/api/lots/<int:lot_id>/spot-map', methods=['GET'])
+@query_budget(3)
+@login_required
+def get_spot_map(lot_id):
+    lot = ParkingLot.query.get_or_404(lot_id)
+    spot_map = current_spot_maps().get(lot)
+    if request.args.get('format') == 'binary':
+        response = make_response(bytes(spot_map.bits))
+        response.mimetype = 'application/octet-stream'
+        response.headers['X-Spot-Count'] = str(spot_map.total)
+        response.headers['X-Spot-Version'] = str(spot_map.version)
+        return response
+    return jsonify(spot_map.to_json())
+
+
+def _sse(event, seq, data):
+    return f'event: {event}\nid: {seq}\ndata: {json.dumps(data)}\n\n'
+
+@main.route('/api/availability', methods=['GET'])
+@login_required
+def get_availability():
+    hub = current_hub()
+    seq, lots = hub.snapshot()
+    return jsonify({'seq': hub.token(seq), 'lots': lots})
+
+@main.route('/api/availability/stream', methods=['GET'])
+@login_required
+def stream_availability():
+    hub = current_hub()
+    seq, lots = hub.snapshot()
+
+    def generate(seq):
+        with hub.listening():
+            yield _sse('snapshot', hub.token(seq), {'seq': hub.token(seq), 'lots': lots})
+            while True:
+                new_seq, changed = hub.wait(seq, LIVE_HEARTBEAT_SECONDS)
+                if new_seq == seq:
+                    yield ': keepalive\n\n'
+                    continue
+                seq = new_seq
+                yield _sse('availability', hub.token(seq), {'seq': hub.token(seq), 'lots': changed})
+
+    response = Response(generate(seq), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@main.route('/api/availability/poll', methods=['GET'])
+@login_required
+def poll_availability():
+    hub = current_hub()
+    since = hub.parse_token(request.args.get('since'))
+    timeout = min(max(request.args.get('timeout', 25, type=float), 0), LIVE_HEARTBEAT_SECONDS * 2)
+    if since is None:
+        # First poll, or a token from another worker or process.
+        seq, lots = hub.snapshot()
+        return jsonify({'seq': hub.token(seq), 'lots': lots, 'snapshot': True})
+    with hub.listening():
+        seq, lots = hub.wait(since, timeout)
+    return jsonify({'seq': hub.token(seq), 'lots': lots, 'snapshot': False})
+
+
+@admin.route('/metrics')
+@admin_required
+def view_metrics():
+    profiler = current_profiler()
+    return render_template('admin/metrics.html', profiler=profiler,
+                           endpoints=profiler.summary() if profiler else [])
+
+
+@main.route('/metrics/prometheus')
+def prometheus_metrics():
+    # Scrapers authenticate with PROFILING_METRICS_TOKEN; admins can also view it.
+    profiler = current_profiler()
+    if profiler is None:
+        abort(404)
+    token = current_app.config.get('PROFILING_METRICS_TOKEN')
+    authorization = request.headers.get('Authorization', '')
+    scraper = bool(token) and hmac.compare_digest(authorization, f'Bearer {token}')
+    if not scraper and not (current_user.is_authenticated and current_user.is_admin):
+        abort(403)
+    return Response(profiler.prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+@admin.route('/jobs')
+@admin_required
+def view_jobs():
+    return render_template('admin/jobs.html', finished=FINISHED)
+
+@admin.route('/api/jobs', methods=['GET'])
+@query_budget(2)
+@admin_required
+def get_jobs():
+    query = select(Job).order_by(Job.id.desc()).limit(50)
+    if request.args.get('active'):
+        query = query.where(Job.status.notin_(FINISHED))
+    return jsonify({'items': [job_json(row) for row in db.session.scalars(query)]})
+
+@admin.route('/api/jobs', methods=['POST'])
+@admin_required
+def submit_job():
+    data = request.get_json(silent=True) or {}
+    try:
+        job = current_jobs().submit(data.get('kind'), data.get('params'), current_user.id)
+    except JobError as e:
+        return jsonify({'error': str(e)}), 400
+    response = jsonify(job_json(job))
+    response.headers['Location'] = url_for('admin.get_job', job_id=job.id)
+    return response, 202
+
+@admin.route('/api/jobs/<int:job_id>', methods=['GET'])
+@admin_required
+def get_job(job_id):
+    return jsonify(job_json(Job.query.get_or_404(job_id)))
+
+@admin.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+@admin_required
+def cancel_job(job_id):
+    job = Job.query.get_or_404(job_id)
+    if not current_jobs().cancel(job.id):
+        return jsonify({'error': 'Job already finished.'}), 409
+    db.session.refresh(job)
+    return jsonify(job_json(job)), 202
+
+@admin.route('/jobs/<int:job_id>/download')
+@admin_required
+def download_job_result(job_id):
+    job = Job.query.get_or_404(job_id)
+    result = job_json(job)['result']
+    if job.status != 'succeeded' or not (result and result.get('file')):
+        abort(404)
+    return send_from_directory(current_jobs().results_dir, result['file'], as_attachment=True,
+                               download_name=f'{job.kind}-{job.id}.{result["format"]}')
+
+@admin.route('/api/response-cache', methods=['GET'])
+@admin_required
+def get_response_cache_stats():
+    return jsonify(current_response_cache().stats())
+
+
+@admin.route('/api/user-cache', methods=['GET'])
+@admin_required
+def get_user_cache_stats():
+    return jsonify(current_user_cache().stats())
 
 
 # API endpoints for parking lots
 @admin.route('/api/lots', methods=['GET'])
+@query_budget(3)
 @admin_required
+@conditional('lots', 'occupancy', per_user=False)
 def get_lots():
-    lots = ParkingLot.query.all()
-    return jsonify([
-        {
-            'id': lot.id,
-            'name': lot.prime_location_name,
-            'address': lot.address,
-            'price_per_hour': lot.price_per_hour,
-            'total_spots': lot.max_spots,
-            'available_spots': lot.available_spots
-        } for lot in lots
-    ])
+    def render_lots():
+        return current_app.json.dumps([
+            {
+                'id': lot.id,
+                'name': lot.prime_location_name,
+                'address': lot.address,
+                'price_per_hour': lot.price_per_hour,
+                'total_spots': lot.max_spots,
+                'available_spots': lot.available_spots
+            } for lot in ParkingLot.query.all()
+        ])
+
+    payload = current_response_cache().fragment('api_lots', ('lots', 'occupancy'), render_lots)
+    return Response(payload, mimetype='application/json')
 
 # API endpoint for spot
+def _spot_json(row):
+    return {
+        'id': row.id,
+        'status': row.status,
+        'is_available': row.status == 'A'
+    }
+
 @admin.route('/api/lots/<int:lot_id>/spots', methods=['GET'])
+@query_budget(3)
 @admin_required
 def get_lot_spots(lot_id):
     lot = ParkingLot.query.get_or_404(lot_id)
-    return jsonify([
-        {
-            'id': spot.id,
-            'status': spot.status,
-            'is_available': spot.is_available()
-        } for spot in lot.spots
-    ])
+    try:
+        limit, after = page_args()
+    except PageArgumentError as e:
+        return jsonify({'error': str(e)}), 400
+
+    query = select(ParkingSpot.id, ParkingSpot.status).where(ParkingSpot.lot_id == lot.id).order_by(ParkingSpot.id)
+    if after:
+        query = query.where(ParkingSpot.id > after[0])
+    if wants_ndjson():
+        return ndjson_response(query, _spot_json)
+
+    rows, next_cursor = fetch_page(query, limit, lambda row: [row.id])
+    return jsonify({'items': [_spot_json(row) for row in rows], 'next_cursor': next_cursor})
 
 # API endpoint for reservations
+def _reservation_json(row):
+    return {
+        'id': row.id,
+        'user': row.username,
+        'spot_id': row.spot_id,
+        'parking_time': row.parking_time.isoformat(),
+        'leaving_time': row.leaving_time.isoformat() if row.leaving_time else None,
+        'cost': stay_cost(row.parking_time, row.leaving_time, row.cost_per_hour)
+    }
+
 @admin.route('/api/reservations', methods=['GET'])
+@query_budget(4)
 @admin_required
 def get_reservations():
-    reservations = Reservation.query.all()
-    return jsonify([
-        {
-            'id': res.id,
-            'user': res.user.username,
-            'spot_id': res.spot_id,
-            'parking_time': res.parking_time.isoformat(),
-            'leaving_time': res.leaving_time.isoformat() if res.leaving_time else None,
-            'cost': res.calculate_total_cost()
-        } for res in reservations
-    ])
+    try:
+        limit, after = page_args()
+    except PageArgumentError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Plain columns joined to users: no ORM objects and no per-row user lookup.
+    # Takes the ledger's filters; archived months inside since/until are included.
+    stays = archive.history(**ledger.parse_filters(request.args))
+    query = select(
+        stays.c.id, User.username, stays.c.spot_id, stays.c.parking_time,
+        stays.c.leaving_time, stays.c.cost_per_hour
+    ).join(User, stays.c.user_id == User.id).order_by(stays.c.id)
+    if after:
+        query = query.where(stays.c.id > after[0])
+    if wants_ndjson():
+        return ndjson_response(query, _reservation_json)
+
+    rows, next_cursor = fetch_page(query, limit, lambda row: [row.id])
+    return jsonify({'items': [_reservation_json(row) for row in rows], 'next_cursor': next_cursor})
 
 # User-specific API endpoints
 @user.route('/api/my-history', methods=['GET'])
+@query_budget(3)
 @login_required
 @user_required
 def get_user_history():
-    reservations = Reservation.query.filter_by(
-        user_id=current_user.id
-    ).filter(
-        Reservation.leaving_time.isnot(None)
-    ).order_by(Reservation.parking_time.desc()).all()
+    since = request.args.get('since', type=datetime.fromisoformat)
+    until = request.args.get('until', type=datetime.fromisoformat)
+    stays = archive.history(current_user.id, since, until, completed=True)
+    reservations = db.session.execute(select(stays).order_by(stays.c.parking_time.desc())).all()
     
     return jsonify([
         {
-            'location': res.spot.lot.prime_location_name,
+            'location': res.location,
             'parking_time': res.parking_time.isoformat(),
             'leaving_time': res.leaving_time.isoformat(),
             'duration': round((res.leaving_time - res.parking_time).total_seconds() / 3600, 1),
-            'cost': res.calculate_total_cost()
+            'cost': stay_cost(res.parking_time, res.leaving_time, res.cost_per_hour)
         } for res in reservations
     ])
 
+@user.route('/api/invoices', methods=['GET'])
+@query_budget(4)
+@login_required
+@user_required
+def get_my_invoice():
+    try:
+        return jsonify(billing.invoice(request.args.get('month'), 'user', current_user.id))
+    except billing.BillingError as e:
+        return jsonify({'error': str(e)}), 400
+
 @user.route('/edit-profile', methods=['GET', 'POST'])
 @login_required
 @user_required
@@ -373,11 +684,17 @@ def edit_profile():
             flash('Passwords do not match.', 'error')
             return redirect(url_for('user.edit_profile'))
         
-        current_user.email = email
-        current_user.full_name = full_name
+        # current_user is a cached principal; edit the real row.
+        profile = db.session.get(User, current_user.id)
+        profile.email = email
+        profile.full_name = full_name
         if password:
-            current_user.set_password(password)
+            profile.set_password(password)
+        bump('users')
         db.session.commit()
+        if password:
+            # The session id carries the password version: renew this session.
+            login_user(profile)
         flash('Profile updated successfully!')
         return redirect(url_for('user.edit_profile'))
-    return render_template('user/edit_profile.html')
\ No newline at end of file
+    return render_template('user/edit_profile.html', profile=db.session.get(User, current_user.id))
\ No newline at end of file
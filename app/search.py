@@ -0,0 +1,162 @@
+import re
+from flask import current_app
+from sqlalchemy import column, or_, select, table, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import joinedload
+from . import db
+from .models import ParkingLot, ParkingSpot, User
+
+PER_PAGE = 25
+
+# External-content FTS5 tables: the text lives in users/parking_lots and the
+# triggers keep the index in step with every INSERT, UPDATE and DELETE,
+# including bulk Core statements that bypass the ORM.
+FTS_INDEXES = {
+    'users_fts': ('users', ('username', 'full_name')),
+    'parking_lots_fts': ('parking_lots', ('prime_location_name', 'address')),
+}
+
+
+def _ddl(fts, source, columns):
+    cols = ', '.join(columns)
+    new = ', '.join(f'new.{c}' for c in columns)
+    old = ', '.join(f'old.{c}' for c in columns)
+    delete_old = f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old});"
+    insert_new = f'INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new});'
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, content='{source}', "
+        f"content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        f'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {source} BEGIN {insert_new} END',
+        f'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {source} BEGIN {delete_old} END',
+        f'CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {source} '
+        f'BEGIN {delete_old} {insert_new} END',
+    ]
+
+
+def init_search(app):
+    """Create the FTS5 indexes and sync triggers (SQLite only).
+
+    Falls back to LIKE matching on other databases or SQLite builds without
+    FTS5. Indexes created for the first time are populated immediately.
+    """
+    app.extensions['search_fts'] = False
+    if db.engine.dialect.name != 'sqlite':
+        return
+    existing = set(db.session.scalars(text("SELECT name FROM sqlite_master WHERE type = 'table'")))
+    try:
+        with db.engine.begin() as conn:
+            for fts, (source, columns) in FTS_INDEXES.items():
+                for statement in _ddl(fts, source, columns):
+                    conn.execute(text(statement))
+    except OperationalError as e:
+        app.logger.warning('Full-text search unavailable, using LIKE matching: %s', e)
+        return
+    app.extensions['search_fts'] = True
+    if not existing.issuperset(FTS_INDEXES):
+        rebuild_search_index()
+
+
+def fts_available():
+    """Whether the FTS5 indexes can be queried.
+
+    init_search() settles this at startup; when the app starts with
+    SKIP_DB_INIT it is looked up on first use instead.
+    """
+    available = current_app.extensions.get('search_fts')
+    if available is None:
+        available = db.engine.dialect.name == 'sqlite' and set(FTS_INDEXES).issubset(db.session.scalars(
+            text("SELECT name FROM sqlite_master WHERE type = 'table'")
+        ))
+        current_app.extensions['search_fts'] = available
+    return available
+
+
+def rebuild_search_index():
+    for fts in FTS_INDEXES:
+        db.session.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+    db.session.commit()
+
+
+def match_expression(query):
+    # Every word must match as a prefix: "cen stat" finds "Central Station".
+    words = re.findall(r'\w+', query)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _ranked(model, fts, weights, query, exclude, offset, limit):
+    if not fts_available():
+        return None
+    expression = match_expression(query)
+    if not expression:
+        return []
+    index = table(fts, column('rowid'))
+    statement = (
+        select(model)
+        .join(index, index.c.rowid == model.id)
+        .where(text(f'{fts} MATCH :match').bindparams(match=expression))
+        .order_by(text(f'bm25({fts}, {weights})'))
+        .limit(limit)
+        .offset(offset)
+    )
+    if exclude:
+        statement = statement.where(model.id.not_in(exclude))
+    return db.session.scalars(statement).all()
+
+
+def _paginate(direct, ranked, page):
+    """Exact id/PIN matches lead, then ranked matches; PER_PAGE per page.
+
+    ranked(exclude, offset, limit) returns ranked matches without the ids
+    in exclude, so the two lists page as one. Returns (results, has_next).
+    """
+    start = (page - 1) * PER_PAGE
+    leading = direct[start:start + PER_PAGE]
+    room = PER_PAGE - len(leading)
+    # One row past the page tells whether there is a next one.
+    rest = ranked([item.id for item in direct], max(0, start - len(direct)), room + 1)
+    return leading + rest[:room], len(direct) > start + PER_PAGE or len(rest) > room
+
+
+def search_users(query, page=1):
+    direct = []
+    if query.isdigit():
+        direct = User.query.filter(User.id == int(query)).all()
+
+    def ranked(exclude, offset, limit):
+        found = _ranked(User, 'users_fts', '10.0, 5.0', query, exclude, offset, limit)
+        if found is not None:
+            return found
+        return User.query.filter(
+            User.username.ilike(f'%{query}%') | User.full_name.ilike(f'%{query}%'), User.id.not_in(exclude)
+        ).order_by(User.username).limit(limit).offset(offset).all()
+    return _paginate(direct, ranked, page)
+
+
+def search_lots(query, page=1):
+    direct = []
+    if query.isdigit():
+        # Enough to fill every page up to this one, plus one to spot a next page.
+        direct = ParkingLot.query.filter(
+            or_(ParkingLot.id == int(query), ParkingLot.pin_code == query)
+        ).order_by(ParkingLot.id).limit(page * PER_PAGE + 1).all()
+
+    def ranked(exclude, offset, limit):
+        found = _ranked(ParkingLot, 'parking_lots_fts', '10.0, 2.0', query, exclude, offset, limit)
+        if found is not None:
+            return found
+        return ParkingLot.query.filter(
+            ParkingLot.prime_location_name.ilike(f'%{query}%') | ParkingLot.address.ilike(f'%{query}%'),
+            ParkingLot.id.not_in(exclude),
+        ).order_by(ParkingLot.prime_location_name).limit(limit).offset(offset).all()
+    return _paginate(direct, ranked, page)
+
+
+def search_spots(query):
+    # Spot ids are integers: look the spot up directly instead of pattern matching.
+    if not query.strip().isdigit():
+        return []
+    return db.session.scalars(
+        select(ParkingSpot)
+        .options(joinedload(ParkingSpot.lot))
+        .where(ParkingSpot.id == int(query.strip()))
+    ).all()
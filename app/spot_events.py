@@ -0,0 +1,33 @@
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Spot status changes are queued on the session and only announced once the
+# transaction commits, so listeners never see a change that was rolled back.
+_listeners = []
+
+
+def on_spot_changes(f):
+    _listeners.append(f)
+    return f
+
+
+def record_spot_change(session, lot_id, spot_id, occupied):
+    session.info.setdefault('spot_changes', []).append((lot_id, spot_id, occupied))
+
+
+def record_lot_reshaped(session, lot_id):
+    # Spots were added or removed: listeners should rebuild, not patch.
+    session.info.setdefault('spot_changes', []).append((lot_id, None, None))
+
+
+@event.listens_for(Session, 'after_commit')
+def _announce(session):
+    changes = session.info.pop('spot_changes', None)
+    if changes:
+        for listener in _listeners:
+            listener(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard(session):
+    session.info.pop('spot_changes', None)
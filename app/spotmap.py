@@ -0,0 +1,121 @@
+import base64
+import threading
+from array import array
+from bisect import bisect_left
+from flask import current_app, has_app_context
+from sqlalchemy import select
+from . import db
+from .models import ParkingSpot
+from .spot_events import on_spot_changes
+
+
+class LotBitmap:
+    """Occupancy of one lot as a bit per spot (1 = occupied), in spot id order."""
+
+    __slots__ = ('lot_id', 'version', 'spot_ids', 'bits', 'occupied')
+
+    def __init__(self, lot_id, version, rows):
+        self.lot_id = lot_id
+        self.version = version
+        self.spot_ids = array('q')
+        self.bits = bytearray((len(rows) + 7) // 8)
+        self.occupied = 0
+        for index, (spot_id, status) in enumerate(rows):
+            self.spot_ids.append(spot_id)
+            if status == 'O':
+                self.bits[index >> 3] |= 1 << (index & 7)
+                self.occupied += 1
+
+    @property
+    def total(self):
+        return len(self.spot_ids)
+
+    @property
+    def available(self):
+        return self.total - self.occupied
+
+    def set(self, spot_id, occupied):
+        index = bisect_left(self.spot_ids, spot_id)
+        if index == len(self.spot_ids) or self.spot_ids[index] != spot_id:
+            return False
+        mask = 1 << (index & 7)
+        if bool(self.bits[index >> 3] & mask) != occupied:
+            self.bits[index >> 3] ^= mask
+            self.occupied += 1 if occupied else -1
+        return True
+
+    def __iter__(self):
+        for index, spot_id in enumerate(self.spot_ids):
+            yield spot_id, bool(self.bits[index >> 3] & (1 << (index & 7)))
+
+    def id_runs(self):
+        # Spot ids are mostly consecutive, so [first_id, count] runs stay tiny.
+        runs = []
+        for spot_id in self.spot_ids:
+            if runs and runs[-1][0] + runs[-1][1] == spot_id:
+                runs[-1][1] += 1
+            else:
+                runs.append([spot_id, 1])
+        return runs
+
+    def to_json(self):
+        return {
+            'lot_id': self.lot_id,
+            'version': self.version,
+            'total': self.total,
+            'available': self.available,
+            'occupied': self.occupied,
+            'spot_ids': self.id_runs(),
+            'bitmap': base64.b64encode(bytes(self.bits)).decode(),
+        }
+
+
+class SpotMapCache:
+    def __init__(self):
+        self._maps = {}
+        self._lock = threading.Lock()
+
+    def get(self, lot):
+        """Return the bitmap for a loaded ParkingLot, rebuilding it if stale.
+
+        Every spot change bumps lot.spot_version, so a map whose version
+        lags the row missed a change made by another process.
+        """
+        with self._lock:
+            bitmap = self._maps.get(lot.id)
+            if bitmap is not None and bitmap.version == lot.spot_version:
+                return bitmap
+        rows = db.session.execute(
+            select(ParkingSpot.id, ParkingSpot.status)
+            .where(ParkingSpot.lot_id == lot.id)
+            .order_by(ParkingSpot.id)
+        ).all()
+        bitmap = LotBitmap(lot.id, lot.spot_version, rows)
+        with self._lock:
+            self._maps[lot.id] = bitmap
+        return bitmap
+
+    def apply(self, changes):
+        with self._lock:
+            for lot_id, spot_id, occupied in changes:
+                bitmap = self._maps.get(lot_id)
+                if bitmap is None:
+                    continue
+                if spot_id is None or not bitmap.set(spot_id, occupied):
+                    del self._maps[lot_id]
+                else:
+                    bitmap.version += 1
+
+
+def init_spot_maps(app):
+    app.extensions['spot_maps'] = SpotMapCache()
+
+
+def current_spot_maps():
+    return current_app.extensions['spot_maps']
+
+
+@on_spot_changes
+def _apply_to_current_app(changes):
+    if has_app_context() and 'spot_maps' in current_app.extensions:
+        current_spot_maps().apply(changes)
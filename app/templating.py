@@ -0,0 +1,41 @@
+import os
+from jinja2 import FileSystemBytecodeCache
+
+
+class TemplateBytecodeCache(FileSystemBytecodeCache):
+    """Compiled templates on disk, shared by every process and cold start.
+
+    The cache may be prebuilt into a read-only bundle, so a failed write
+    just means the next process compiles that template again.
+    """
+
+    def dump_bytecode(self, bucket):
+        try:
+            super().dump_bytecode(bucket)
+        except OSError:
+            pass
+
+
+def init_template_cache(app):
+    # An empty TEMPLATE_CACHE_DIR turns the cache off.
+    directory = app.config.setdefault(
+        'TEMPLATE_CACHE_DIR',
+        os.environ.get('TEMPLATE_CACHE_DIR', os.path.join(app.instance_path, 'template-cache')),
+    )
+    if not directory:
+        return
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError as e:
+        app.logger.warning('Template bytecode cache disabled: %s', e)
+        return
+    # jinja_options is read when the environment is first built, on the first render.
+    app.jinja_options = {**app.jinja_options, 'bytecode_cache': TemplateBytecodeCache(directory)}
+
+
+def precompile_templates(app):
+    """Compile every template into the bytecode cache; returns how many."""
+    names = app.jinja_env.list_templates(extensions=('html',))
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
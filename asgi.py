@@ -0,0 +1,7 @@
+from app import create_app
+from app.async_api import mount
+
+# ASGI entry point: the async read-only API under /api/async, the Flask app
+# for everything else, e.g. `uvicorn asgi:app --workers 4`.
+flask_app = create_app()
+app = mount(flask_app)
@@ -0,0 +1,247 @@
+"""Load test: the async read API against the sync endpoints it mirrors.
+
+Seeds a throwaway SQLite database, starts the app twice as separate
+processes - the threaded Flask server for the sync endpoints and
+`uvicorn asgi:app` for /api/async - and holds --connections concurrent
+keep-alive connections against each pair of endpoints for --duration
+seconds. Prints throughput, errors and p50/p95/p99 latency as JSON.
+
+    python -m benchmarks.async_load --connections 1000 --duration 10
+
+Thousands of connections need a matching open-file limit (ulimit -n), and
+the load generator itself runs on one core, so compare the two columns
+rather than reading either as the server's ceiling.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+from benchmarks.suite import ADMIN, PASSWORD, build_app, seed
+from app import db
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+USER_AGENT = 'async-load/1'
+SESSIONS = 20
+
+# name: (sync path, async path, session); {lot} is a random lot id.
+SCENARIOS = {
+    'lots': ('/admin/api/lots', '/api/async/lots', 'admin'),
+    'availability': ('/api/availability', '/api/async/lots/{lot}/availability', 'user'),
+    'my_reservations': ('/user/reservations', '/api/async/my-reservations', 'user'),
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(command, port, env):
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f'{command[2]} exited with status {process.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise SystemExit(f'{command[2]} did not start listening on port {port}')
+
+
+class Connection:
+    """Minimal HTTP/1.1 client; reconnects when the server closes."""
+
+    def __init__(self, port):
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, cookie=None, body=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.port)
+        head = [f'{method} {path} HTTP/1.1', 'Host: 127.0.0.1', f'User-Agent: {USER_AGENT}']
+        if cookie:
+            head.append(f'Cookie: session={cookie}')
+        payload = urlencode(body).encode() if body else b''
+        if body:
+            head += ['Content-Type: application/x-www-form-urlencoded', f'Content-Length: {len(payload)}']
+        self.writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + payload)
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('connection closed')
+        status = int(status_line.split()[1])
+        headers = {}
+        while (line := await self.reader.readline()) not in (b'\r\n', b''):
+            name, _, value = line.decode('latin-1').partition(':')
+            headers.setdefault(name.strip().lower(), []).append(value.strip())
+        length = headers.get('content-length')
+        if length is None:
+            await self.reader.read()  # no length: the body runs to the end of the connection
+        else:
+            await self.reader.readexactly(int(length[0]))
+        connection_header = ','.join(headers.get('connection', ())).lower()
+        keep_alive = status_line.startswith(b'HTTP/1.1') or 'keep-alive' in connection_header
+        if length is None or 'close' in connection_header or not keep_alive:
+            await self.close()
+        return status, headers
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = self.reader = None
+
+
+async def log_in(port, username, password):
+    connection = Connection(port)
+    try:
+        status, headers = await connection.request('POST', '/login', body={'username': username, 'password': password})
+    finally:
+        await connection.close()
+    cookie = SimpleCookie()
+    for header in headers.get('set-cookie', ()):
+        cookie.load(header)
+    if status != 302 or 'session' not in cookie:
+        raise SystemExit(f'Could not log in as {username} (status {status})')
+    return cookie['session'].value
+
+
+async def prepare_sessions(port, lot_ids, users, rng):
+    """Log in the admin and SESSIONS users, each holding one active reservation."""
+    admin = await log_in(port, *ADMIN)
+    sessions = []
+    for i in rng.sample(range(users), min(SESSIONS, users)):
+        cookie = await log_in(port, f'bench{i}', PASSWORD)
+        connection = Connection(port)
+        await connection.request('POST', f'/user/reserve/{rng.choice(lot_ids)}', cookie)
+        await connection.close()
+        sessions.append(cookie)
+    return {'admin': [admin], 'user': sessions}
+
+
+async def hammer(port, path, cookies, lot_ids, connections, duration, rng):
+    latencies, errors = [], 0
+    deadline = time.monotonic() + duration
+
+    async def worker(index):
+        nonlocal errors
+        connection = Connection(port)
+        cookie = cookies[index % len(cookies)]
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                status, _ = await connection.request('GET', path.format(lot=rng.choice(lot_ids)), cookie)
+            except (OSError, ConnectionError, asyncio.IncompleteReadError):
+                errors += 1
+                await connection.close()
+                continue
+            if status == 200:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+        await connection.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(connections)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2) if latencies else None
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 2) if latencies else None,
+    }
+
+
+async def drive(args, ports, lot_ids, rng):
+    sessions = await prepare_sessions(ports['sync'], lot_ids, args.users, rng)
+    results = {}
+    for name, (sync_path, async_path, session) in SCENARIOS.items():
+        if args.only and name not in args.only:
+            continue
+        results[name] = {}
+        for target, path in (('sync', sync_path), ('async', async_path)):
+            results[name][target] = {'path': path, **await hammer(
+                ports[target], path, sessions[session], lot_ids, args.connections, args.duration, rng
+            )}
+            print(f'{name} {target}: {results[name][target]}', file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lots', type=int, default=20)
+    parser.add_argument('--spots-per-lot', type=int, default=100)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--history', type=int, default=20000)
+    parser.add_argument('--connections', type=int, default=500, help='Concurrent connections per run.')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per endpoint.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--only', action='append', choices=list(SCENARIOS), help='Run only this scenario.')
+    parser.add_argument('--output', help='Write the JSON results here as well as to stdout.')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    servers = []
+    try:
+        app = build_app(db_path)
+        lot_ids, _ = seed(app, args.lots, args.spots_per_lot, args.users, args.history, rng)
+        with app.app_context():
+            db.engine.dispose()
+
+        env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}', SKIP_DB_INIT='1')
+        ports = {'sync': free_port(), 'async': free_port()}
+        servers.append(start_server(
+            [sys.executable, '-m', 'flask', '--app', 'main', 'run', '--with-threads', '--port', str(ports['sync'])],
+            ports['sync'], env,
+        ))
+        servers.append(start_server(
+            [sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', str(ports['async']),
+             '--log-level', 'warning', '--no-access-log', '--backlog', str(max(2048, args.connections))],
+            ports['async'], env,
+        ))
+        results = {
+            'connections': args.connections,
+            'duration': args.duration,
+            'scale': {'lots': args.lots, 'spots_per_lot': args.spots_per_lot,
+                      'users': args.users, 'history': args.history},
+            'scenarios': asyncio.run(drive(args, ports, lot_ids, rng)),
+        }
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Month-end billing: vectorized invoices against a row-by-row loop.
+
+Seeds one month of completed stays into a throwaway SQLite database, then
+times billing.invoices() per user and per lot against fetching the same
+rows as datetimes and summing stay_cost_paise() one stay at a time. Fails
+if any invoice total differs between the two.
+
+    python -m benchmarks.billing --stays 1000000 --users 5000 --lots 50
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, select
+
+from app import billing, create_app, db
+from app.models import ParkingLot, ParkingSpot, Reservation, User, stay_cost_paise
+
+MONTH = '2025-01'
+BATCH = 50000
+
+
+def seed(app, stays, users, lots, rng):
+    started = time.perf_counter()
+    month_start = datetime.strptime(MONTH, '%Y-%m')
+    with app.app_context():
+        db.session.execute(insert(User), [
+            {'username': f'bill{i}', 'email': f'bill{i}@example.com', 'full_name': f'Bill {i}', 'password_hash': '-'}
+            for i in range(users)
+        ])
+        db.session.execute(insert(ParkingLot), [
+            {'prime_location_name': f'Lot {i}', 'address': f'{i} Billing Road', 'pin_code': '560001',
+             'price_per_hour': rng.choice((10, 12.5, 20, 35)), 'max_spots': 1}
+            for i in range(lots)
+        ])
+        lot_rows = db.session.execute(select(ParkingLot.id, ParkingLot.price_per_hour)).all()
+        db.session.execute(insert(ParkingSpot), [{'lot_id': lot_id, 'status': 'A'} for lot_id, _ in lot_rows])
+        spot_of = dict(db.session.execute(select(ParkingSpot.lot_id, ParkingSpot.id)).all())
+        user_ids = db.session.scalars(select(User.id)).all()
+        for offset in range(0, stays, BATCH):
+            rows = []
+            for _ in range(min(BATCH, stays - offset)):
+                lot_id, price = rng.choice(lot_rows)
+                parked = month_start + timedelta(seconds=rng.uniform(0, 30 * 86400))
+                rows.append({'user_id': rng.choice(user_ids), 'spot_id': spot_of[lot_id], 'lot_id': lot_id,
+                             'parking_time': parked,
+                             'leaving_time': parked + timedelta(seconds=rng.uniform(300, 12 * 3600)),
+                             'cost_per_hour': price})
+            db.session.execute(insert(Reservation), rows)
+        db.session.commit()
+    return time.perf_counter() - started
+
+
+def row_by_row(by):
+    start = datetime.strptime(MONTH, '%Y-%m')
+    key = Reservation.user_id if by == 'user' else Reservation.lot_id
+    totals = {}
+    rows = db.session.execute(
+        select(key, Reservation.parking_time, Reservation.leaving_time, Reservation.cost_per_hour)
+        .where(Reservation.parking_time >= start, Reservation.parking_time < start + timedelta(days=31),
+               Reservation.leaving_time.isnot(None))
+    )
+    for key_id, parking_time, leaving_time, cost_per_hour in rows:
+        totals[key_id] = totals.get(key_id, 0) + stay_cost_paise(parking_time, leaving_time, cost_per_hour)
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stays', type=int, default=200000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--lots', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    app = None
+    try:
+        app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}'})
+        seconds = seed(app, args.stays, args.users, args.lots, random.Random(args.seed))
+        print(f'Seeded {args.stays} stays in {seconds:.1f}s')
+        with app.app_context():
+            for by in billing.BILL_BY:
+                started = time.perf_counter()
+                _, items = billing.invoices(MONTH, by)
+                vectorized = time.perf_counter() - started
+                started = time.perf_counter()
+                expected = row_by_row(by)
+                looped = time.perf_counter() - started
+                if {item[f'{by}_id']: item['amount_paise'] for item in items} != expected:
+                    raise SystemExit(f'per-{by} totals differ between billing.invoices() and the row loop')
+                print(f'per {by}: {len(items)} invoices, vectorized {vectorized:.2f}s, '
+                      f'row by row {looped:.2f}s ({looped / vectorized:.1f}x)')
+    finally:
+        if app is not None:
+            with app.app_context():
+                db.engine.dispose()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Cold-start cost of the app: import, create_app() and the first requests.
+
+Each run is a fresh interpreter, as on a serverless cold start. Modes:
+
+- memory: full startup against an in-memory database (schema, search
+  indexes and the admin password hash on every start)
+- full: full startup against an already migrated file database
+- skip_init: SKIP_DB_INIT=1, templates compiled on first render
+- precompiled: SKIP_DB_INIT=1 with templates precompiled into the cache
+
+Reports the median and worst of each phase in milliseconds as JSON.
+
+    python -m benchmarks.startup --runs 10
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter; prints one JSON object of timings.
+CHILD = '''
+import json, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app({'SESSION_COOKIE_SECURE': False})
+created = time.perf_counter()
+client = app.test_client()
+assert client.get(PATH).status_code == 200
+first = time.perf_counter()
+client.get(PATH)
+second = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': (first - created) * 1000,
+    'second_request_ms': (second - first) * 1000,
+    'total_ms': (second - started) * 1000,
+}))
+'''
+
+
+def child_env(**overrides):
+    env = dict(os.environ)
+    for name in ('SKIP_DB_INIT', 'TEMPLATE_CACHE_DIR', 'DATABASE_URL'):
+        env.pop(name, None)
+    env.update(overrides)
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    # Bytecode for the app's own modules is assumed present, as in a deploy bundle.
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    return env
+
+
+def flask_command(env, *args):
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', *args], env=env, cwd=ROOT,
+                   check=True, stdout=subprocess.DEVNULL)
+
+
+def measure(env, path, runs):
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-c', f'PATH = {path!r}\n' + CHILD], env=env, cwd=ROOT,
+                                check=True, capture_output=True, text=True)
+        samples.append(json.loads(result.stdout.splitlines()[-1]))
+    return {
+        phase: {'median': round(statistics.median(s[phase] for s in samples), 1),
+                'max': round(max(s[phase] for s in samples), 1)}
+        for phase in samples[0]
+    }
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='startup-bench-')
+    try:
+        database_url = f'sqlite:///{os.path.join(workdir, "parking.db")}'
+        warm_cache = os.path.join(workdir, 'template-cache')
+        setup = child_env(DATABASE_URL=database_url, SKIP_DB_INIT='1', TEMPLATE_CACHE_DIR=warm_cache)
+        flask_command(setup, 'migrate')
+        flask_command(setup, 'seed-admin')
+        flask_command(setup, 'precompile-templates')
+
+        modes = {
+            'memory': child_env(DATABASE_URL='sqlite:///:memory:', TEMPLATE_CACHE_DIR=''),
+            'full': child_env(DATABASE_URL=database_url, TEMPLATE_CACHE_DIR=''),
+            'skip_init': child_env(DATABASE_URL=database_url, SKIP_DB_INIT='1', TEMPLATE_CACHE_DIR=''),
+            'precompiled': child_env(DATABASE_URL=database_url, SKIP_DB_INIT='1', TEMPLATE_CACHE_DIR=warm_cache),
+        }
+        results = {'path': args.path, 'runs': args.runs, 'modes': {}}
+        for name, env in modes.items():
+            if args.only and name not in args.only:
+                continue
+            results['modes'][name] = measure(env, args.path, args.runs)
+            print(f'{name}: {results["modes"][name]}', file=sys.stderr)
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10, help='Fresh interpreters per mode.')
+    parser.add_argument('--path', default='/login', help='Page requested after startup.')
+    parser.add_argument('--only', action='append', help='Run only this mode (repeatable).')
+    parser.add_argument('--output', help='Write the JSON results here as well as to stdout.')
+    args = parser.parse_args()
+
+    output = json.dumps(run(args), indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""Concurrent booking stress test for the spot allocator.
+
+Starts N threads that all POST /user/reserve/<lot_id> against a shared
+file-backed SQLite database at the same moment, then checks that no spot
+was handed out twice and that the lot counters match parking_spots.
+Then mixes batch and single-spot claims and releases across two app
+instances on the same database, standing in for two workers, and checks
+that each one's spot map cache agrees with the database whenever read.
+
+    python -m benchmarks.stress_reserve --bookers 64 --spots 40
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from werkzeug.security import generate_password_hash
+
+from app import create_app, db
+from app.allocator import claim_spot, claim_spots, free_spot, free_spots
+from app.models import ParkingLot, ParkingSpot, Reservation, User
+from app.spotmap import current_spot_maps
+
+# A cheap hash keeps seeding and logins fast. It is also the configured
+# method, so logins do not queue background rehashes during the run.
+PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+
+
+def build_app(db_path):
+    return create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+        'SESSION_COOKIE_SECURE': False,
+        'TESTING': True,
+        'PASSWORD_HASH_METHOD': PASSWORD_HASH_METHOD,
+    })
+
+
+def seed(app, bookers, spots):
+    password_hash = generate_password_hash('stress', method=PASSWORD_HASH_METHOD)
+    with app.app_context():
+        lot = ParkingLot(prime_location_name='Stress Lot', address='1 Stress Test Road',
+                         pin_code='000000', price_per_hour=10, max_spots=spots,
+                         available_count=spots, occupied_count=0)
+        db.session.add(lot)
+        db.session.add_all(ParkingSpot(lot=lot) for _ in range(spots))
+        db.session.add_all(
+            User(username=f'booker{i}', email=f'booker{i}@example.com',
+                 full_name=f'Booker {i}', password_hash=password_hash)
+            for i in range(bookers)
+        )
+        db.session.commit()
+        return lot.id
+
+
+def run(bookers, spots, rounds):
+    fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    app = None
+    try:
+        app = build_app(db_path)
+        lot_id = seed(app, bookers, spots)
+
+        clients = []
+        for i in range(bookers):
+            client = app.test_client()
+            client.post('/login', data={'username': f'booker{i}', 'password': 'stress'})
+            clients.append(client)
+
+        barrier = threading.Barrier(bookers)
+        errors = []
+
+        def book(client):
+            barrier.wait()
+            for _ in range(rounds):
+                try:
+                    response = client.post(f'/user/reserve/{lot_id}')
+                except Exception as e:
+                    # TESTING propagates view errors into the client call.
+                    errors.append(type(e).__name__)
+                    continue
+                if response.status_code != 302:
+                    errors.append(response.status_code)
+
+        threads = [threading.Thread(target=book, args=(c,)) for c in clients]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        with app.app_context():
+            active = Reservation.query.filter(Reservation.leaving_time.is_(None)).all()
+            spot_ids = [r.spot_id for r in active]
+            occupied = ParkingSpot.query.filter_by(lot_id=lot_id, status='O').count()
+            lot = db.session.get(ParkingLot, lot_id)
+
+            failures = []
+            if len(spot_ids) != len(set(spot_ids)):
+                failures.append('a spot was reserved more than once')
+            if len(spot_ids) != min(bookers * rounds, spots):
+                failures.append(f'expected {min(bookers * rounds, spots)} reservations, got {len(spot_ids)}')
+            if occupied != len(spot_ids):
+                failures.append(f'{occupied} spots occupied for {len(spot_ids)} reservations')
+            if (lot.occupied_count, lot.available_count) != (occupied, spots - occupied):
+                failures.append(f'counters {lot.occupied_count}/{lot.available_count} out of sync')
+            if errors:
+                failures.append(f'{len(errors)} requests failed: {sorted(set(map(str, errors)))}')
+
+        print(f'{bookers} bookers x {rounds} rounds on {spots} spots: '
+              f'{len(spot_ids)} reservations in {elapsed:.2f}s')
+        for failure in failures:
+            print(f'FAIL: {failure}')
+        return not failures
+    finally:
+        if app is not None:
+            with app.app_context():
+                db.engine.dispose()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+
+
+def _spot_map_step(rng, lot_id):
+    occupied = db.session.scalars(
+        db.select(ParkingSpot.id).where(ParkingSpot.lot_id == lot_id, ParkingSpot.status == 'O')
+    ).all()
+    action = rng.choice(('claim', 'claim_many', 'free', 'free_many'))
+    if action == 'claim':
+        claim_spot(lot_id)
+    elif action == 'claim_many':
+        claim_spots([lot_id], rng.randint(2, 3))
+    elif action == 'free' and occupied:
+        free_spot(rng.choice(occupied), lot_id)
+    elif occupied:
+        free_spots(rng.sample(occupied, min(len(occupied), rng.randint(2, 3))))
+    db.session.commit()
+    return action
+
+
+def check_spot_maps(steps, spots=8, seed=1):
+    """Each worker's cached bitmap must match parking_spots whenever it is
+    read, after any mix of batch and single-spot changes by either worker.
+    """
+    fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    workers = []
+    rng = random.Random(seed)
+    failures = []
+    try:
+        workers = [build_app(db_path), build_app(db_path)]
+        with workers[0].app_context():
+            lot = ParkingLot(prime_location_name='Map Lot', address='2 Stress Test Road', pin_code='000000',
+                             price_per_hour=10, max_spots=spots, available_count=spots, occupied_count=0)
+            db.session.add(lot)
+            db.session.add_all(ParkingSpot(lot=lot) for _ in range(spots))
+            db.session.commit()
+            lot_id = lot.id
+        actions = []
+        for step in range(steps):
+            with workers[rng.randrange(2)].app_context():
+                actions.append(_spot_map_step(rng, lot_id))
+            for index, app in enumerate(workers):
+                # Reading a map rebuilds it when stale, so a worker that
+                # checked after every step would never drift: check at random.
+                if rng.random() > 0.3:
+                    continue
+                with app.app_context():
+                    expected = dict(db.session.execute(
+                        db.select(ParkingSpot.id, ParkingSpot.status == 'O').where(ParkingSpot.lot_id == lot_id)
+                    ).all())
+                    cached = dict(current_spot_maps().get(db.session.get(ParkingLot, lot_id)))
+                    if cached != expected:
+                        failures.append(f'worker {index} served a stale spot map after {actions}')
+            if failures:
+                break
+        print(f'{steps} mixed spot changes across 2 workers on {spots} spots')
+    finally:
+        for app in workers:
+            with app.app_context():
+                db.engine.dispose()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bookers', type=int, default=32)
+    parser.add_argument('--spots', type=int, default=20)
+    parser.add_argument('--rounds', type=int, default=2)
+    parser.add_argument('--map-steps', type=int, default=200, help='Mixed spot changes for the spot map check.')
+    args = parser.parse_args()
+    ok = run(args.bookers, args.spots, args.rounds)
+    ok = check_spot_maps(args.map_steps) and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,360 @@
+"""Latency and throughput benchmarks for the booking hot paths.
+
+Seeds a throwaway SQLite database at the requested scale (lots, spots per
+lot, users, historical reservations), then drives the real app through the
+Flask test client (or, with --server, a local threaded WSGI server over
+HTTP) across login, the lot list, reserve, release, reports and the JSON
+APIs. Prints p50/p95/p99 latency and throughput per scenario as JSON.
+
+    python -m benchmarks.suite --lots 50 --spots-per-lot 200 --users 500 \\
+        --history 50000 --requests 300 --concurrency 8 --output results.json
+
+Pass --baseline results.json on a later run to compare against it; the
+exit status is 1 if any scenario's p95 latency or throughput regressed by
+more than --tolerance.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+from sqlalchemy import insert, select
+from werkzeug.security import generate_password_hash
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from app import create_app, db
+from app.models import ParkingLot, ParkingSpot, Reservation, User
+from app.provisioning import import_lots
+from app.rollups import rebuild_rollups
+
+PASSWORD = 'benchmark'
+ADMIN = ('admin', 'admin123')
+
+
+def build_app(db_path):
+    return create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+        'SESSION_COOKIE_SECURE': False,
+    })
+
+
+def seed(app, lots, spots_per_lot, users, history, rng):
+    started = time.perf_counter()
+    with app.app_context():
+        import_lots([
+            {'name': f'Benchmark Lot {i}', 'address': f'{i} Benchmark Avenue, Sector {i % 40}',
+             'pin_code': f'{560000 + i % 1000:06d}', 'price_per_hour': rng.choice((10, 20, 30, 50)),
+             'max_spots': spots_per_lot}
+            for i in range(lots)
+        ])
+        # One hash with the configured method, shared by every user.
+        password_hash = generate_password_hash(PASSWORD, method=app.config['PASSWORD_HASH_METHOD'])
+        db.session.execute(insert(User), [
+            {'username': f'bench{i}', 'email': f'bench{i}@example.com', 'full_name': f'Bench User {i}',
+             'password_hash': password_hash, 'password_version': 1}
+            for i in range(users)
+        ])
+        db.session.commit()
+
+        user_ids = db.session.scalars(select(User.id).where(User.is_admin.isnot(True))).all()
+        spots = db.session.execute(
+            select(ParkingSpot.id, ParkingSpot.lot_id, ParkingLot.price_per_hour).join(ParkingLot)
+        ).all()
+        now = datetime.utcnow()
+        batch = []
+        for _ in range(history):
+            spot_id, lot_id, price = rng.choice(spots)
+            parking_time = now - timedelta(days=rng.uniform(1, 90))
+            batch.append({'spot_id': spot_id, 'lot_id': lot_id, 'user_id': rng.choice(user_ids),
+                          'parking_time': parking_time,
+                          'leaving_time': parking_time + timedelta(hours=rng.uniform(0.25, 10)),
+                          'cost_per_hour': price})
+            if len(batch) == 10000:
+                db.session.execute(insert(Reservation), batch)
+                batch = []
+        if batch:
+            db.session.execute(insert(Reservation), batch)
+        db.session.commit()
+        rebuild_rollups()
+        lot_ids = db.session.scalars(select(ParkingLot.id)).all()
+    return lot_ids, time.perf_counter() - started
+
+
+class TestClient:
+    """Adapter over the Flask test client; returns status codes only."""
+
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self._client.open(path, method=method, data=data)
+        response.close()
+        return response.status_code
+
+
+class HttpClient:
+    """Keep-alive HTTP client carrying the session cookie; never follows redirects."""
+
+    def __init__(self, port):
+        self._connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        self._cookies = SimpleCookie()
+
+    def request(self, method, path, data=None):
+        headers = {}
+        body = None
+        if self._cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v.value}' for k, v in self._cookies.items())
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        self._connection.request(method, path, body=body, headers=headers)
+        response = self._connection.getresponse()
+        response.read()
+        for header in response.headers.get_all('Set-Cookie') or ():
+            self._cookies.load(header)
+        return response.status
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+# Returned by a step that has no more work for its client.
+DONE = object()
+
+
+def run_scenario(step, clients, requests, concurrency):
+    """Run up to `requests` calls of step(client, i) over `concurrency` threads.
+
+    Thread t always uses clients[t % len(clients)], so a client (and its
+    session cookie) is never shared between threads when there are enough.
+    """
+    latencies = []
+    errors = 0
+    issued = 0
+    lock = threading.Lock()
+    barrier = threading.Barrier(concurrency)
+
+    def worker(client):
+        nonlocal errors, issued
+        barrier.wait()
+        while True:
+            with lock:
+                if issued == requests:
+                    return
+                i = issued
+                issued += 1
+            started = time.perf_counter()
+            try:
+                ok = step(client, i)
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                if ok is DONE:
+                    issued -= 1  # hand the request back to the other threads
+                    return
+                latencies.append(elapsed)
+                errors += not ok
+
+    threads = [threading.Thread(target=worker, args=(clients[t % len(clients)],)) for t in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+    if not latencies:
+        return {'requests': 0, 'errors': errors}
+
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(cuts[49] * 1000, 3),
+        'p95_ms': round(cuts[94] * 1000, 3),
+        'p99_ms': round(cuts[98] * 1000, 3),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+        'throughput_rps': round(len(latencies) / wall, 1),
+    }
+
+
+def scenarios(app, make_client, lot_ids, users, concurrency, rng):
+    """Yield (name, step, clients, requests or None for the default) in run order."""
+
+    def logged_in(username, password=PASSWORD):
+        client = make_client()
+        status = client.request('POST', '/login', {'username': username, 'password': password})
+        if status != 302:
+            raise RuntimeError(f'login as {username} failed with {status}')
+        return client
+
+    yield 'login', lambda c, i: make_client().request(
+        'POST', '/login', {'username': f'bench{i % users}', 'password': PASSWORD}
+    ) == 302, [None], None
+
+    drivers = [logged_in(f'bench{i}') for i in range(min(users, concurrency))]
+    admins = [logged_in(*ADMIN) for _ in range(concurrency)]
+    spot_map_lots = rng.sample(lot_ids, min(len(lot_ids), 20))
+
+    yield 'view_parking_lots', lambda c, i: c.request('GET', '/user/parking-lots') == 200, drivers, None
+    yield 'reserve_spot', lambda c, i: c.request(
+        'POST', f'/user/reserve/{lot_ids[i % len(lot_ids)]}'
+    ) == 302, drivers, None
+
+    # Each driver releases what it booked; looking up the ids is not timed.
+    with app.app_context():
+        active = db.session.execute(
+            select(User.username, Reservation.id).join(User)
+            .where(Reservation.leaving_time.is_(None)).order_by(Reservation.id)
+        ).all()
+    pending = {f'bench{i}': [] for i in range(len(drivers))}
+    for username, reservation_id in active:
+        pending[username].append(reservation_id)
+    queues = {id(drivers[i]): pending[f'bench{i}'] for i in range(len(drivers))}
+
+    def release(c, i):
+        queue = queues[id(c)]
+        if not queue:
+            return DONE
+        return c.request('POST', f'/user/release/{queue.pop()}') == 302
+
+    yield 'release_spot', release, drivers, sum(map(len, queues.values()))
+    yield 'view_reports', lambda c, i: c.request('GET', '/admin/reports') == 200, admins, None
+    yield 'admin_ledger', lambda c, i: c.request(
+        'GET', f'/admin/reservations?lot_id={lot_ids[i % len(lot_ids)]}&status=completed'
+    ) == 200, admins, None
+    yield 'api_availability', lambda c, i: c.request('GET', '/api/availability') == 200, drivers, None
+    yield 'api_spot_map', lambda c, i: c.request(
+        'GET', f'/api/lots/{spot_map_lots[i % len(spot_map_lots)]}/spot-map'
+    ) == 200, drivers, None
+    yield 'api_my_history', lambda c, i: c.request('GET', '/user/api/my-history') == 200, drivers, None
+    yield 'api_admin_lots', lambda c, i: c.request('GET', '/admin/api/lots') == 200, admins, None
+    yield 'api_admin_reservations', lambda c, i: c.request(
+        'GET', '/admin/api/reservations?limit=100'
+    ) == 200, admins, None
+
+
+def compare(results, baseline, tolerance):
+    """Per-scenario ratios against a baseline run and the list of regressions."""
+    comparison, regressions = {}, []
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous is None:
+            continue
+        p95 = current['p95_ms'] / previous['p95_ms'] if previous['p95_ms'] else None
+        throughput = current['throughput_rps'] / previous['throughput_rps'] if previous['throughput_rps'] else None
+        comparison[name] = {'p95_ratio': p95 and round(p95, 3), 'throughput_ratio': throughput and round(throughput, 3)}
+        if p95 is not None and p95 > 1 + tolerance:
+            regressions.append(f'{name}: p95 {previous["p95_ms"]} -> {current["p95_ms"]} ms')
+        if throughput is not None and throughput < 1 - tolerance:
+            regressions.append(f'{name}: throughput {previous["throughput_rps"]} -> {current["throughput_rps"]} req/s')
+    return comparison, regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    app = server = None
+    try:
+        app = build_app(db_path)
+        lot_ids, seed_seconds = seed(app, args.lots, args.spots_per_lot, args.users, args.history, rng)
+
+        if args.server:
+            server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            make_client = lambda: HttpClient(server.server_port)
+        else:
+            make_client = lambda: TestClient(app)
+
+        results = {
+            'meta': {
+                'revision': git_revision(),
+                'started_at': datetime.utcnow().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'transport': 'http' if args.server else 'test_client',
+                'scale': {'lots': args.lots, 'spots_per_lot': args.spots_per_lot,
+                          'users': args.users, 'history': args.history},
+                'requests': args.requests,
+                'concurrency': args.concurrency,
+                'seed': args.seed,
+                'seed_seconds': round(seed_seconds, 2),
+            },
+            'scenarios': {},
+        }
+        for name, step, clients, requests in scenarios(app, make_client, lot_ids, args.users, args.concurrency, rng):
+            if args.only and name not in args.only:
+                continue
+            results['scenarios'][name] = run_scenario(step, clients, requests or args.requests, args.concurrency)
+            print(f'{name}: {results["scenarios"][name]}', file=sys.stderr)
+        return results
+    finally:
+        if server is not None:
+            server.shutdown()
+        if app is not None:
+            with app.app_context():
+                db.engine.dispose()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lots', type=int, default=20)
+    parser.add_argument('--spots-per-lot', type=int, default=100)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--history', type=int, default=20000, help='Completed past reservations to seed.')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario.')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--server', action='store_true', help='Serve over HTTP instead of the test client.')
+    parser.add_argument('--only', action='append', help='Run only this scenario (repeatable).')
+    parser.add_argument('--output', help='Write the JSON results here as well as to stdout.')
+    parser.add_argument('--baseline', help='Results JSON from an earlier run to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='Allowed relative p95/throughput regression against the baseline.')
+    args = parser.parse_args()
+
+    results = run(args)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            comparison, regressions = compare(results, json.load(f), args.tolerance)
+        results['baseline'] = {'path': args.baseline, 'tolerance': args.tolerance,
+                               'scenarios': comparison, 'regressions': regressions}
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    for regression in regressions:
+        print(f'REGRESSION: {regression}', file=sys.stderr)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Per-request cost of loading the logged-in user, with and without the cache.
+
+Logs one user in and replays a cheap authenticated request (the availability
+snapshot, which is served from memory) against a file-backed SQLite
+database, once with the principal cache disabled and once enabled, and
+reports the mean latency and SQL statements per request.
+
+    python -m benchmarks.user_loader --requests 2000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+
+from app import create_app, db
+from app.models import User
+
+# Also the configured method, so the login does not queue a background rehash.
+PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+
+
+def measure(cache_size, requests):
+    fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    app = None
+    try:
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+            'SESSION_COOKIE_SECURE': False,
+            'USER_CACHE_SIZE': cache_size,
+            'PASSWORD_HASH_METHOD': PASSWORD_HASH_METHOD,
+        })
+        with app.app_context():
+            db.session.add(User(username='bench', email='bench@example.com', full_name='Bench',
+                                password_hash=generate_password_hash('bench', method=PASSWORD_HASH_METHOD)))
+            db.session.commit()
+            engine = db.engine
+
+        client = app.test_client()
+        client.post('/login', data={'username': 'bench', 'password': 'bench'})
+        client.get('/api/availability')  # warm the availability snapshot
+
+        statements = 0
+
+        def count(*args):
+            nonlocal statements
+            statements += 1
+
+        event.listen(engine, 'before_cursor_execute', count)
+        started = time.perf_counter()
+        for _ in range(requests):
+            response = client.get('/api/availability')
+            assert response.status_code == 200, response.status_code
+        elapsed = time.perf_counter() - started
+        event.remove(engine, 'before_cursor_execute', count)
+        return elapsed / requests * 1000, statements / requests, app.extensions['user_cache'].stats()
+    finally:
+        if app is not None:
+            with app.app_context():
+                db.engine.dispose()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    uncached_ms, uncached_sql, _ = measure(0, args.requests)
+    cached_ms, cached_sql, stats = measure(1024, args.requests)
+    print(f'uncached: {uncached_ms:.3f} ms/request, {uncached_sql:.2f} SQL statements/request')
+    print(f'cached:   {cached_ms:.3f} ms/request, {cached_sql:.2f} SQL statements/request')
+    print(f'saved:    {uncached_ms - cached_ms:.3f} ms/request '
+          f'(hit ratio {stats["hit_ratio"]}, {stats["misses"]} misses)')
+
+
+if __name__ == '__main__':
+    main()